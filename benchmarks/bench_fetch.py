@@ -0,0 +1,114 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+# 不稳定网络下获取数据的耗时: 使用注入了长尾延迟和错误的本地模拟接口，对比开启和关闭对冲请求时get_price()的尾延迟，以及接口中断时的熔断
+# 运行: python ./benchmarks/bench_fetch.py [--tickers 2000] [--rounds 200] [--stall-rate 0.02] [--error-rate 0.02]
+
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stock_terminal as st
+from sina_server import make_symbols, start_server
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+# 清空上一轮测试留下的状态
+def reset_state():
+    st.quote_fingerprints.clear()
+    st.stage_timings = st.StageTimings(st.timing_samples)
+    st.fetch_breaker = st.CircuitBreaker(st.breaker_failure_threshold, st.breaker_reset_duration)
+    st.hedged_count = 0
+
+
+# 连续获取rounds次，返回 (每次的耗时, 各结果的次数)
+def run_rounds(server, symbols, rounds):
+    samples = []
+    outcomes = Counter()
+    for _ in range(rounds):
+        server.simulator.tick(force=True)
+        start = time.perf_counter()
+        try:
+            st.get_price(symbols)
+            outcomes['ok'] += 1
+        except Exception as e:
+            outcomes[type(e).__name__] += 1
+        samples.append(time.perf_counter() - start)
+    return samples, outcomes
+
+
+def bench_hedging(server, symbols, rounds, hedging):
+    st.enable_hedged_requests = hedging
+    reset_state()
+    # 预热: 建立连接，积累请求耗时的样本
+    run_rounds(server, symbols, st.hedge_min_samples)
+    st.hedged_count = 0
+    samples, outcomes = run_rounds(server, symbols, rounds)
+    return {
+        'hedging': hedging,
+        'p50_ms': percentile(samples, 0.5) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': max(samples) * 1000,
+        'hedged': st.hedged_count,
+        'outcomes': dict(outcomes),
+    }
+
+
+# 接口中断时熔断器直接返回失败，不再等待超时
+def bench_outage(server, symbols, rounds):
+    st.enable_hedged_requests = True
+    reset_state()
+    faults = dict(server.faults)
+    server.faults.update(error_rate=1, stall_rate=0)
+    try:
+        samples, outcomes = run_rounds(server, symbols, rounds)
+    finally:
+        server.faults.update(faults)
+    return {
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'max_ms': max(samples) * 1000,
+        'outcomes': dict(outcomes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='不稳定网络下获取数据的耗时')
+    parser.add_argument('--tickers', type=int, default=2000, help='股票数量')
+    parser.add_argument('--rounds', type=int, default=200, help='测试轮数')
+    parser.add_argument('--latency', type=float, default=20, help='模拟接口的延迟(ms)')
+    parser.add_argument('--jitter', type=float, default=10, help='延迟的随机抖动(ms)')
+    parser.add_argument('--stall-rate', type=float, default=0.02, help='长尾请求的比例')
+    parser.add_argument('--stall', type=float, default=1500, help='长尾请求的额外延迟(ms)')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='返回503的请求比例')
+    args = parser.parse_args()
+
+    symbols = make_symbols(args.tickers)
+    faults = {'error_rate': args.error_rate, 'stall_rate': args.stall_rate, 'stall': args.stall, 'reset_rate': 0}
+    server, url = start_server(symbols, latency=args.latency, jitter=args.jitter, faults=faults, tick_interval=float('inf'))
+    st.quote_url = url
+    try:
+        results = [bench_hedging(server, symbols, args.rounds, hedging) for hedging in [False, True]]
+        outage = bench_outage(server, symbols, 20)
+    finally:
+        server.shutdown()
+
+    batches = (len(symbols) + st.max_batch_size - 1) // st.max_batch_size
+    print('股票数: {}  批次数: {}  长尾请求: {:.0%} +{:g}ms  错误: {:.0%}  时间预算: {:g}s'.format(
+        len(symbols), batches, args.stall_rate, args.stall, args.error_rate, st.fetch_budget))
+    print('{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}  {}'.format('对冲', 'p50', 'p95', 'p99', 'max', '对冲请求', '结果'))
+    for result in results:
+        print('{:>10}{:>12.1f}{:>12.1f}{:>12.1f}{:>12.1f}{:>12}  {}'.format(
+            '开启' if result['hedging'] else '关闭', result['p50_ms'], result['p95_ms'], result['p99_ms'], result['max_ms'], result['hedged'], result['outcomes']))
+    print('接口中断: 平均 {:.1f}ms  最大 {:.1f}ms  {}'.format(outage['mean_ms'], outage['max_ms'], outage['outcomes']))
+    print('单位: ms')
+
+
+if __name__ == '__main__':
+    main()
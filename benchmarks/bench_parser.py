@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+# 对比旧的正则解析方式和流式解析器解析接口响应的耗时
+# 运行: python ./benchmarks/bench_parser.py [股票数量]
+
+import os
+import re
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stock_terminal
+
+# 生成模拟的接口响应
+def build_payload(count):
+    lines = []
+    for i in range(count):
+        pre_close = round(random.uniform(5, 50), 2)
+        price = round(pre_close * random.uniform(0.9, 1.1), 3)
+        fields = [
+            '股票{}'.format(i), '{:.3f}'.format(pre_close), '{:.3f}'.format(pre_close), '{:.3f}'.format(price),
+            '{:.3f}'.format(max(price, pre_close)), '{:.3f}'.format(min(price, pre_close)),
+            '{:.3f}'.format(price), '{:.3f}'.format(price), str(random.randint(1, 10 ** 9)), '{:.3f}'.format(random.uniform(1, 10 ** 10)),
+        ]
+        for _ in range(10):
+            fields += [str(random.randint(1, 10 ** 6)), '{:.3f}'.format(price)]
+        fields += ['2024-11-29', '14:59:57', '00']
+        lines.append('var hq_str_sz{:06d}="{}";\n'.format(i, ','.join(fields)))
+    return ''.join(lines).encode('gb18030')
+
+
+# 旧的解析方式: 正则提取 + 字符串列表，之后在生成表格时反复调用float()
+def parse_regex(body):
+    res = body.decode('gb18030')
+    result = {}
+    pattern = re.compile(r'var hq_str_(.*)="(.*)"')
+    for s in res.split(';'):
+        s = s.strip()
+        match = pattern.match(s)
+        if match:
+            result[match.group(1)] = match.group(2).split(',')
+    # get_update_table()中每行的数值转换
+    for data in result.values():
+        float(data[3]) - float(data[2])
+        float(data[3]) - float(data[2])
+        float(data[3]) - float(data[2])
+        (float(data[3]) - float(data[2])) / float(data[2])
+        (float(data[4]) - float(data[2])) / float(data[2])
+        (float(data[5]) - float(data[2])) / float(data[2])
+        float(data[8]) / 100
+        float(data[9]) / 10000
+    return result
+
+
+# 流式解析: 按块输入，数值只解析一次
+def parse_stream(body, chunk_size=stock_terminal.stream_chunk_size):
+    parser = stock_terminal.QuoteStreamParser()
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i:i + chunk_size])
+    result = parser.close()
+    for data in result.values():
+        data.price - data.pre_close
+        (data.high - data.pre_close) / data.pre_close
+        (data.low - data.pre_close) / data.pre_close
+        data.volume / 100
+        data.amount / 10000
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    body = build_payload(count)
+    assert len(parse_regex(body)) == len(parse_stream(body)) == count
+
+    print('股票数量: {}  响应大小: {:.1f} KB'.format(count, len(body) / 1024))
+    for name, func in [('正则解析', parse_regex), ('流式解析', parse_stream)]:
+        number = 20
+        best = min(timeit.repeat(lambda: func(body), number=number, repeat=5)) / number
+        print('{}: {:.2f} ms'.format(name, best * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+# 刷新流程的性能测试: 使用本地模拟接口，在不同股票数量下分别统计各阶段和完整刷新的耗时及内存峰值
+# 运行: python ./benchmarks/bench_refresh.py [--sizes 30 500 5000] [--rounds 10] [--json result.json]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stock_terminal as st
+from sina_server import make_symbols, start_server
+
+# 渲染表格时使用的终端大小
+screen_size = (200, 50)
+
+
+# 清空上一轮测试留下的状态
+def reset_state():
+    st.last_price.clear()
+    st.quote_fingerprints.clear()
+    st.stock_list = []
+    st.quote_store = st.QuoteStore()
+    st.intraday_history = st.IntradayHistory()
+    st.bar_aggregator = st.BarAggregator()
+    st.quote_table = st.QuoteTable(st.table_columns, st.get_table_row)
+    st.leaderboards = {name: st.Leaderboard(st.scanner_top_n, key) for name, key in st.sort_modes if key is not None}
+    st.price_monitor_data.clear()
+    st.fluctuation_monitor_data.clear()
+    st.custom_monitor_data.clear()
+    st.custom_monitor_triggered_data.clear()
+
+
+# 为每只股票设置若干个价格和涨跌幅监控
+def add_alerts(symbols, snapshot):
+    for symbol in symbols:
+        quote = snapshot.get(symbol)
+        if quote is None:
+            continue
+        alert_book = st.AlertBook()
+        for i in range(1, 6):
+            alert_book.add('price', round(quote.price * (1 + i / 100), 2))
+            alert_book.add('price', round(quote.price * (1 - i / 100), 2))
+            alert_book.add('percent', i)
+            alert_book.add('percent', -i)
+        st.custom_monitor_data[symbol] = alert_book
+
+
+def render():
+    st.get_update_table().render(screen_size)
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+def bench_size(server, url, count, rounds):
+    simulator = server.simulator
+    symbols = make_symbols(count)
+    st.watchlist = st.Watchlist({'自选': symbols})
+    st.quote_url = url
+    reset_state()
+
+    # 预热: 建立连接，生成初始数据和监控
+    snapshot = st.get_snapshot()
+    st.get_update_table(snapshot)
+    render()
+    add_alerts(symbols, snapshot)
+    # 模拟接口没有url长度限制，一次获取全部股票的响应用于单独测试解析
+    body = st.get_http_session().get(url + ','.join(symbols)).content
+
+    timings = {name: [] for name in ['fetch', 'parse', 'store', 'monitor', 'alert', 'render', 'total']}
+    changed = []
+    for _ in range(rounds):
+        # 每轮更新一次行情(一次刷新中的多个批次请求看到的是同一时刻的数据)
+        simulator.tick(force=True)
+        start = time.perf_counter()
+        snapshot = st.get_price(symbols)
+        timings['fetch'].append(time.perf_counter() - start)
+        changed.append(st.changed_count)
+
+        start = time.perf_counter()
+        parser = st.QuoteStreamParser()
+        parser.feed(body)
+        parser.close()
+        timings['parse'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        st.update_custom_monitor_data(st.last_price, snapshot)
+        timings['alert'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        rows = st.quote_store.update(snapshot)
+        st.intraday_history.update(st.quote_store, rows)
+        st.bar_aggregator.update(st.quote_store, rows)
+        st.last_price.update(snapshot)
+        st.stock_list = list(snapshot)
+        timings['store'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        st.update_monitor_data(snapshot)
+        timings['monitor'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        render()
+        timings['render'].append(time.perf_counter() - start)
+
+        # 完整刷新: 获取数据 -> 更新数据和监控 -> 渲染
+        simulator.tick(force=True)
+        start = time.perf_counter()
+        st.get_update_table(st.get_snapshot()).render(screen_size)
+        timings['total'].append(time.perf_counter() - start)
+
+    # 内存峰值(单独测量，避免tracemalloc影响计时)
+    tracemalloc.start()
+    for _ in range(max(rounds // 3, 1)):
+        simulator.tick(force=True)
+        st.get_update_table(st.get_snapshot()).render(screen_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {'tickers': count, 'changed': sum(changed) / len(changed), 'peak_memory_mb': peak / 1024 / 1024}
+    for name, samples in timings.items():
+        result[name] = {
+            'mean_ms': sum(samples) / len(samples) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='刷新流程的性能测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[30, 500, 5000], help='测试的股票数量')
+    parser.add_argument('--rounds', type=int, default=10, help='每种股票数量的测试轮数')
+    parser.add_argument('--latency', type=float, default=0, help='模拟接口的延迟(ms)')
+    parser.add_argument('--change-rate', type=float, default=0.3, help='每轮价格发生变化的股票比例')
+    parser.add_argument('--json', metavar='FILE', help='将结果写入json文件，便于对比')
+    args = parser.parse_args()
+
+    # 只统计正常情况下的耗时，关闭时间预算和对冲请求(tracemalloc会明显拖慢请求)，网络异常的情况见bench_fetch.py
+    st.fetch_budget = float('inf')
+    st.request_timeout = [30, 30]
+    st.enable_hedged_requests = False
+    # 监控事件只计数，不发送通知
+    notifications = []
+    st.event_listeners.append(notifications.append)
+
+    server, url = start_server(make_symbols(max(args.sizes)), latency=args.latency, tick_interval=float('inf'), change_rate=args.change_rate)
+    results = []
+    try:
+        for count in args.sizes:
+            results.append(bench_size(server, url, count, args.rounds))
+    finally:
+        server.shutdown()
+
+    stages = ['fetch', 'parse', 'store', 'monitor', 'alert', 'render', 'total']
+    print('{:>8}'.format('股票数') + '{:>8}'.format('变化') + ''.join('{:>16}'.format(stage) for stage in stages) + '{:>12}'.format('内存峰值'))
+    for result in results:
+        line = '{:>10}'.format(result['tickers']) + '{:>10.0f}'.format(result['changed'])
+        for stage in stages:
+            line += '{:>16}'.format('{:.2f}/{:.2f}'.format(result[stage]['mean_ms'], result[stage]['p95_ms']))
+        line += '{:>12}'.format('{:.1f}MB'.format(result['peak_memory_mb']))
+        print(line)
+    print('单位: ms (平均/p95)，监控事件数: {}'.format(len(notifications)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
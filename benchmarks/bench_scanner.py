@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+# 全市场扫描时排行榜的耗时: 对比每次刷新只检查发生变化的股票(Leaderboard)和每次对全部股票排序，并检查两者的排名是否一致
+# 运行: python ./benchmarks/bench_scanner.py [--tickers 13000] [--rounds 200] [--change-rate 0.3]
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stock_terminal as st
+from sina_server import MarketSimulator, make_symbols
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+
+# 模拟接口的一次响应，只保留发生变化的股票(与get_price()跳过没有变化的股票一致)
+def next_snapshot(simulator, symbols, previous):
+    simulator.tick(force=True)
+    parser = st.QuoteStreamParser()
+    parser.feed(simulator.response(symbols))
+    quotes = parser.close()
+    snapshot = {symbol: quote for symbol, quote in quotes.items() if previous.get(symbol) != quote}
+    previous.update(snapshot)
+    return snapshot
+
+
+# 对全部股票排序，返回排名前n的行号(指标相同时按行号排序)
+def full_sort(store, key, n):
+    rows = np.arange(store.size)
+    return rows[np.lexsort((rows, -key(store, rows)))[:n]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='全市场扫描时排行榜的耗时')
+    parser.add_argument('--tickers', type=int, default=13000, help='股票数量')
+    parser.add_argument('--rounds', type=int, default=200, help='刷新次数')
+    parser.add_argument('--change-rate', type=float, default=0.3, help='每次刷新价格发生变化的股票比例')
+    parser.add_argument('--top', type=int, default=st.scanner_top_n, help='排行榜显示的股票数量')
+    args = parser.parse_args()
+
+    symbols = make_symbols(args.tickers)
+    simulator = MarketSimulator(symbols, tick_interval=float('inf'), change_rate=args.change_rate, seed=1)
+    store = st.QuoteStore()
+    modes = [(name, key) for name, key in st.sort_modes if key is not None]
+    leaderboards = {name: st.Leaderboard(args.top, key) for name, key in modes}
+    # 快速异动的指标由异动监控写入，这里用与上一次价格的变化代替
+    previous = {}
+
+    incremental = {name: [] for name, _ in modes}
+    full = {name: [] for name, _ in modes}
+    mismatches = 0
+    changed = []
+    for _ in range(args.rounds):
+        snapshot = next_snapshot(simulator, symbols, previous)
+        rows = store.update(snapshot)
+        store.fluctuation[rows] = store.diff[rows] / np.where(store.columns['pre_close'][rows] == 0, 1, store.columns['pre_close'][rows]) * 100
+        changed.append(len(rows))
+        for name, key in modes:
+            start = time.perf_counter()
+            leaderboards[name].update(store, rows)
+            incremental[name].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            expected = full_sort(store, key, args.top)
+            full[name].append(time.perf_counter() - start)
+            # 指标相同的股票排名可能不同，只比较指标
+            if not np.array_equal(key(store, leaderboards[name].ranking), key(store, expected)):
+                mismatches += 1
+
+    print('股票数: {}  平均变化: {:.0f}  排行榜: 前{}  刷新次数: {}'.format(args.tickers, sum(changed) / len(changed), args.top, args.rounds))
+    print('{:>8}{:>20}{:>20}{:>12}'.format('排序', '增量(平均/p95)', '全量排序(平均/p95)', '重新选出'))
+    for name, _ in modes:
+        print('{:>8}{:>24}{:>24}{:>14}'.format(
+            name,
+            '{:.3f}/{:.3f}'.format(sum(incremental[name]) / args.rounds * 1000, percentile(incremental[name], 0.95) * 1000),
+            '{:.3f}/{:.3f}'.format(sum(full[name]) / args.rounds * 1000, percentile(full[name], 0.95) * 1000),
+            leaderboards[name].rebuilds))
+    print('单位: ms，排名不一致: {}'.format(mismatches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+# 分片模式的吞吐量: 对比单进程获取全部股票和多个分片进程通过共享内存传递数据时每秒获取和解析的股票数
+# 模拟接口同样以多个进程运行(SO_REUSEPORT)，避免模拟接口本身成为瓶颈
+# 运行: python ./benchmarks/bench_shards.py [--symbols 20000] [--shards 1 2 4] [--duration 5]
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import stock_terminal as st
+from sina_server import make_symbols
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# 启动count个模拟接口进程，等待可以连接
+def start_servers(count, port, symbols, change_rate):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sina_server.py')
+    servers = [subprocess.Popen([sys.executable, script, '--port', str(port), '--symbols', str(symbols), '--change-rate', str(change_rate),
+                                 '--tick-interval', '1', '--seed', '1', '--reuse-port'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(count)]
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    # 等待所有进程完成数据初始化
+    time.sleep(1 + symbols / 20000)
+    return servers
+
+
+# 单进程: 连续获取全部股票
+def bench_single(symbols, duration):
+    st.get_price(symbols)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        st.get_price(symbols)
+        count += 1
+    return count * len(symbols) / (time.perf_counter() - start), None
+
+
+# 分片: 各分片进程连续获取，主进程按shard_read_interval读取共享内存
+def bench_shards(symbols, shards, duration):
+    source = st.ShardedSource(symbols, shards)
+    try:
+        # 等待所有分片完成第一次获取(启动进程、建立连接)
+        deadline = time.time() + 60
+        while (source.states['fetches'] == 0).any() and time.time() < deadline:
+            source.next_snapshot()
+            time.sleep(0.05)
+        sizes = [source.bounds[i + 1] - source.bounds[i] for i in range(source.count)]
+        fetches = source.states['fetches'].copy()
+        read_times = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            read_start = time.perf_counter()
+            source.next_snapshot()
+            read_times.append(time.perf_counter() - read_start)
+            time.sleep(st.shard_read_interval)
+        elapsed = time.perf_counter() - start
+        done = source.states['fetches'] - fetches
+        return sum(int(count) * size for count, size in zip(done, sizes)) / elapsed, sorted(read_times)[len(read_times) // 2]
+    finally:
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分片模式的吞吐量')
+    parser.add_argument('--symbols', type=int, default=20000, help='股票数量')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4], help='测试的分片进程数')
+    parser.add_argument('--servers', type=int, default=os.cpu_count(), help='模拟接口的进程数')
+    parser.add_argument('--duration', type=float, default=5, help='每种情况的测试时间(s)')
+    parser.add_argument('--change-rate', type=float, default=0.3, help='每秒价格发生变化的股票比例')
+    args = parser.parse_args()
+
+    symbols = make_symbols(args.symbols)
+    port = free_port()
+    servers = start_servers(args.servers, port, args.symbols, args.change_rate)
+    # 只比较吞吐量: 分片进程连续获取，不限制单次获取的时间
+    st.quote_url = 'http://127.0.0.1:{}/list='.format(port)
+    st.follow_trading_hours = False
+    st.refresh_duration = 0
+    st.fetch_budget = float('inf')
+    st.enable_hedged_requests = False
+    st.shard_read_interval = 0.5
+    try:
+        results = [('单进程', *bench_single(symbols, args.duration))]
+        for shards in args.shards:
+            results.append(('{}个分片'.format(shards), *bench_shards(symbols, shards, args.duration)))
+    finally:
+        for server in servers:
+            server.terminate()
+
+    print('CPU核数: {}  股票数: {}  模拟接口进程数: {}'.format(os.cpu_count(), args.symbols, args.servers))
+    print('{:>8}{:>14}{:>10}{:>16}'.format('方式', '股票数/秒', '加速比', '读取耗时(ms)'))
+    for name, throughput, read_time in results:
+        print('{:>10}{:>16.0f}{:>12.2f}{:>18}'.format(name, throughput, throughput / results[0][1], '-' if read_time is None else '{:.2f}'.format(read_time * 1000)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+# 本地模拟的行情接口，返回与 hq.sinajs.cn 相同格式的数据，用于离线测试和性能测试
+# 运行: python ./benchmarks/sina_server.py --port 8765 --symbols 5000 --latency 50
+# 终端连接: python ./stock_terminal.py --quote-url http://127.0.0.1:8765/list=
+# 模拟不稳定的网络: --error-rate 0.05 --stall-rate 0.05 --stall 3000
+
+import time
+import socket
+import random
+import argparse
+import threading
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 生成count个股票代码(深市在前，沪市在后)
+def make_symbols(count):
+    half = (count + 1) // 2
+    return ['sz{:06d}'.format(i) for i in range(1, half + 1)] + ['sh{:06d}'.format(600000 + i) for i in range(count - half)]
+
+
+# 模拟的行情数据，每个tick_interval秒按照随机游走更新一次价格
+class MarketSimulator:
+
+    def __init__(self, symbols, tick_interval=3, change_rate=0.5, volatility=0.002, seed=None):
+        self.random = random.Random(seed)
+        self.tick_interval = tick_interval
+        # 每次更新时价格发生变化的股票比例
+        self.change_rate = change_rate
+        # 每次价格变化的标准差(相对值)
+        self.volatility = volatility
+        self.lock = threading.Lock()
+        self.last_tick = 0
+        self.now = time.localtime()
+        # 收到的请求数和请求的股票总数
+        self.request_count = 0
+        self.symbol_count = 0
+        # 股票代码 -> [名字, 今开, 昨收, 当前价格, 最高, 最低, 成交数, 成交额, 数据时间]
+        # 与真实接口一样，没有成交的股票数据时间不变，响应内容与上一次完全相同
+        self.stocks = {}
+        for i, symbol in enumerate(symbols):
+            pre_close = round(self.random.uniform(3, 100), 2)
+            self.stocks[symbol] = ['模拟{:04d}'.format(i % 10000), pre_close, pre_close, pre_close, pre_close, pre_close, 0, 0.0, self.now]
+
+    # 到达更新时间(或force为True)时更新所有股票的价格
+    def tick(self, force=False):
+        with self.lock:
+            now = time.time()
+            if not force and now - self.last_tick < self.tick_interval:
+                return
+            self.last_tick = now
+            self.now = time.localtime(now)
+            for stock in self.stocks.values():
+                if self.random.random() >= self.change_rate:
+                    continue
+                price = max(round(stock[3] * (1 + self.random.gauss(0, self.volatility)), 2), 0.01)
+                volume = self.random.randint(1, 500) * 100
+                stock[3] = price
+                stock[4] = max(stock[4], price)
+                stock[5] = min(stock[5], price)
+                stock[6] += volume
+                stock[7] += volume * price
+                stock[8] = self.now
+
+    # 生成一只股票的响应数据，不存在的股票返回空数据
+    def format(self, symbol):
+        stock = self.stocks.get(symbol)
+        if stock is None:
+            return 'var hq_str_{}="";\n'.format(symbol)
+        name, open_price, pre_close, price, high, low, volume, amount, now = stock
+        fields = [name, '{:.3f}'.format(open_price), '{:.3f}'.format(pre_close), '{:.3f}'.format(price),
+                  '{:.3f}'.format(high), '{:.3f}'.format(low), '{:.3f}'.format(price - 0.01), '{:.3f}'.format(price),
+                  str(volume), '{:.3f}'.format(amount)]
+        for i in range(5):
+            fields += [str((i + 1) * 1000), '{:.3f}'.format(price - 0.01 * (i + 1))]
+        for i in range(5):
+            fields += [str((i + 1) * 1000), '{:.3f}'.format(price + 0.01 * i)]
+        fields += [time.strftime('%Y-%m-%d', now), time.strftime('%H:%M:%S', now), '00']
+        return 'var hq_str_{}="{}";\n'.format(symbol, ','.join(fields))
+
+    def response(self, symbols):
+        self.tick()
+        with self.lock:
+            self.request_count += 1
+            self.symbol_count += len(symbols)
+        return ''.join(self.format(symbol) for symbol in symbols).encode('gb18030')
+
+
+# 注入的故障，可以在运行中修改(如设置error_rate为1模拟接口中断)
+# error_rate: 返回503的请求比例
+# stall_rate/stall: 额外延迟stall(ms)的请求比例，模拟长尾延迟
+# reset_rate: 不返回数据直接断开连接的请求比例
+def make_faults(error_rate=0, stall_rate=0, stall=0, reset_rate=0):
+    return {'error_rate': error_rate, 'stall_rate': stall_rate, 'stall': stall, 'reset_rate': reset_rate}
+
+
+# 多个进程监听同一个端口(SO_REUSEPORT)，由内核分配连接，避免模拟接口本身成为多进程测试的瓶颈
+class ReusePortHTTPServer(ThreadingHTTPServer):
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def make_handler(simulator, latency=0, jitter=0, faults=None):
+    faults = make_faults() if faults is None else faults
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 响应头和响应体分开发送，关闭Nagle算法避免本地测试出现额外的延迟
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            path = unquote(self.path)
+            if 'list=' not in path:
+                self.send_error(404)
+                return
+            symbols = [symbol for symbol in path.split('list=', 1)[1].split(',') if symbol != '']
+            body = simulator.response(symbols)
+            if latency > 0 or jitter > 0:
+                time.sleep(max(latency + random.uniform(-jitter, jitter), 0) / 1000)
+            if random.random() < faults['stall_rate']:
+                time.sleep(faults['stall'] / 1000)
+            if random.random() < faults['reset_rate']:
+                self.close_connection = True
+                return
+            if random.random() < faults['error_rate']:
+                self.send_error(503)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/javascript; charset=GB18030')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+# 在后台线程中启动模拟接口，返回 (server, 接口地址)
+# 模拟的行情数据为server.simulator，注入的故障为server.faults
+def start_server(symbols, port=0, latency=0, jitter=0, faults=None, **kwargs):
+    simulator = MarketSimulator(symbols, **kwargs)
+    faults = make_faults() if faults is None else faults
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(simulator, latency, jitter, faults))
+    server.simulator = simulator
+    server.faults = faults
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/list='.format(server.server_address[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的行情接口')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--symbols', type=int, default=5000, help='模拟的股票数量')
+    parser.add_argument('--latency', type=float, default=0, help='每次请求的延迟(ms)')
+    parser.add_argument('--jitter', type=float, default=0, help='延迟的随机抖动(ms)')
+    parser.add_argument('--tick-interval', type=float, default=3, help='价格更新间隔(s)')
+    parser.add_argument('--change-rate', type=float, default=0.5, help='每次更新时价格发生变化的股票比例')
+    parser.add_argument('--volatility', type=float, default=0.002, help='每次价格变化的标准差(相对值)')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回503的请求比例')
+    parser.add_argument('--stall-rate', type=float, default=0, help='额外延迟--stall的请求比例')
+    parser.add_argument('--stall', type=float, default=3000, help='长尾请求的额外延迟(ms)')
+    parser.add_argument('--reset-rate', type=float, default=0, help='直接断开连接的请求比例')
+    parser.add_argument('--reuse-port', action='store_true', help='允许多个进程监听同一个端口')
+    parser.add_argument('--seed', type=int, help='随机数种子(多个进程使用相同的种子时初始数据相同)')
+    args = parser.parse_args()
+
+    simulator = MarketSimulator(make_symbols(args.symbols), args.tick_interval, args.change_rate, args.volatility, args.seed)
+    faults = make_faults(args.error_rate, args.stall_rate, args.stall, args.reset_rate)
+    server_class = ReusePortHTTPServer if args.reuse_port else ThreadingHTTPServer
+    server = server_class(('127.0.0.1', args.port), make_handler(simulator, args.latency, args.jitter, faults))
+    print('模拟接口: http://127.0.0.1:{}/list=  股票数量: {}'.format(args.port, args.symbols))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
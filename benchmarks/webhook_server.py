@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# -*- coding: utf8 -*-
+# 本地的webhook接收端，打印收到的通知，用于测试 webhook 通知方式
+# 运行: python ./benchmarks/webhook_server.py --port 8780
+# 终端连接: python ./stock_terminal.py --notify desktop,webhook --notify-webhook http://127.0.0.1:8780/notify
+
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_handler(received, delay=0, quiet=False):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            # 模拟较慢的通知服务
+            if delay > 0:
+                time.sleep(delay / 1000)
+            notification = json.loads(body)
+            received.append(notification)
+            if not quiet:
+                print('[{}] {}\n{}\n'.format(time.strftime('%H:%M:%S'), notification['title'], notification['message']), flush=True)
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return Handler
+
+
+# 在后台线程中启动接收端，返回 (server, 地址)，收到的通知保存在server.received中
+def start_server(port=0, delay=0):
+    received = []
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(received, delay, quiet=True))
+    server.daemon_threads = True
+    server.received = received
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/notify'.format(server.server_address[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地的webhook接收端')
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--delay', type=float, default=0, help='每次请求的处理延迟(ms)')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler([], args.delay))
+    print('webhook接收端: http://127.0.0.1:{}/notify'.format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
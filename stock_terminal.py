@@ -3,27 +3,123 @@
 # @Author: Devin-Kung
 # Project: https://github.com/Devin-Kung/stock_terminal
 
+import os
+import sys
+import json
+import signal
+import queue
+import socket
 import re
+import argparse
+import time
+import threading
 import urwid
-import requests
-from datetime import datetime
-from rich import print
-from rich.table import Table
-from rich.console import Console
-import chinese_calendar as calendar
-from rich.style import Style
-from plyer import notification
-
-# 是否开启自动刷新(非交易时间默认关闭，可手动开启)
+import numpy as np
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import namedtuple, deque
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+# 是否开启自动刷新
 auto_refresh = True
 # 是否启用调色板(彩色输出)
 use_palette = False
 # 自动刷新间隔(s)(接口的数据更新频率为3s)
 refresh_duration = 3
+# 是否按照交易时间自动刷新(休市时暂停，开盘后自动恢复)，也可以通过 --ignore-trading-hours 关闭
+follow_trading_hours = True
+# 交易时段(包含集合竞价和收盘后的缓冲时间)，非交易日(周末和节假日)全天休市
+trading_sessions = [['09:15', '11:30'], ['13:00', '15:05']]
+# 非重点股票的刷新间隔(s)，重点股票(当前选择、设置了自定义监控、正在异动)每次刷新都会获取
+cold_refresh_duration = 9
+# 接口的数据时间不再更新时(停牌、接口异常等)刷新间隔逐次翻倍，不超过该值(s)
+max_backoff_duration = 30
 # 是否启用股票异动监控(快速拉升/快速下跌)
 enable_price_monitor = True
 # 异动监控的阈值(指定时间内涨跌幅超过阈值则触发)[时间(s), 涨跌幅(%)]
 monitor_threshold = [30, 2]
+# 额外的异动监控阈值，与monitor_threshold同时生效，格式相同，如 [[5 * 60, 5]]
+extra_monitor_thresholds = [[5 * 60, 5]]
+# 异动信息的显示时长(s)
+fluctuation_display_duration = 3 * 60
+# 行情接口地址，也可以通过 --quote-url 指定(如本地模拟接口 benchmarks/sina_server.py)
+quote_url = 'http://hq.sinajs.cn/list='
+# 单次请求的最大股票数量(股票过多时url过长会导致请求失败，超出后自动拆分为多个请求)
+max_batch_size = 200
+# 拆分后的最大并发请求数
+max_concurrent_requests = 8
+# 流式读取响应时每次读取的字节数
+stream_chunk_size = 16 * 1024
+# 单个请求的超时时间 [连接超时(s), 读取超时(s)]
+request_timeout = [2, 2]
+# 每次刷新获取数据的时间预算(s)，超时后本次刷新失败，界面继续显示上一次的数据
+fetch_budget = 2.5
+# 是否发送对冲请求: 批次请求超过最近请求耗时的p95仍未完成时，再发送一个相同的请求，先完成的结果生效
+enable_hedged_requests = True
+# 对冲请求的最小延迟(s)，避免请求耗时很短时频繁发送重复请求
+hedge_min_delay = 0.1
+# 请求耗时的样本不足hedge_min_samples次时使用的对冲延迟(s)
+hedge_default_delay = 1
+hedge_min_samples = 20
+# 熔断: 连续失败breaker_failure_threshold次后breaker_reset_duration秒内不再请求，界面继续显示最后一次成功获取的数据并标记为已过期
+breaker_failure_threshold = 3
+breaker_reset_duration = 15
+# 记录数据的文件路径(为None时不记录)，每次获取的数据都会追加写入该文件，也可以通过 --record 指定
+record_file = None
+# 回放的记录文件路径(为None时获取实时数据)，也可以通过 --replay 指定
+replay_file = None
+# 回放速度倍数(0为不等待，尽可能快地回放)，也可以通过 --speed 指定
+replay_speed = 1
+# 持仓文件路径(json，{股票代码: {"quantity": 数量, "cost": 成本价}}，为None时不显示持仓)，也可以通过 --positions 指定
+positions_file = None
+# 检查点文件路径(为None时不保存)，定期保存最后的数据、异动监控和自定义监控，重新启动时恢复，也可以通过 --checkpoint 指定
+checkpoint_file = None
+# 保存检查点的间隔(s)，退出时也会保存一次
+checkpoint_interval = 60
+# 共享行情hub的Unix socket路径(为None时直接请求接口)，也可以通过 --hub 指定，hub进程通过 --serve-hub 启动
+hub_socket = None
+# hub中每个终端等待发送的消息数上限，超出后断开该终端(终端会自动重新连接并重新获取完整数据)
+hub_queue_size = 16
+# 分片进程数(0为不使用)，股票很多时将股票平均分给多个进程分别获取和解析，数据通过共享内存传给界面，也可以通过 --shards 指定
+shard_count = 0
+# 分片模式下读取共享内存的间隔(s)
+shard_read_interval = 1
+# 分片进程超过该时间(s)没有心跳时视为卡死，结束后重新启动
+shard_stall_timeout = 60
+# 分时数据占用的最大内存(字节)，股票较多时每只股票保存的数据条数会相应减少
+history_memory_limit = 128 * 1024 * 1024
+# 走势列的宽度(字符数)，按交易时间将当日平均分段，每段显示该段最后的价格
+sparkline_width = 24
+# 是否在顶部显示各阶段的耗时(p50/p95/最大值，ms)，可通过 T/t 切换
+show_timings = False
+# 统计耗时时每个阶段保留的最近次数
+timing_samples = 200
+# K线周期(s)，由快照的成交量和成交额增量生成，表格中的分钟量使用第一个周期
+bar_timeframes = [60, 5 * 60]
+# 自定义监控的通知方式，可同时使用多个: desktop(桌面通知)/log(写入notify_log_file)/webhook(POST到notify_webhook_url)
+# 也可以通过 --notify 指定，如 --notify desktop,log
+notify_sinks = ['desktop']
+# 通知日志文件
+notify_log_file = 'stock_terminal_notify.log'
+# 通知的webhook地址(如本地的 benchmarks/webhook_server.py)
+notify_webhook_url = 'http://127.0.0.1:8780/notify'
+# 同一只股票的同一个监控值在该时间内(s)重复触发时不再通知(价格在监控值附近来回波动时)
+notify_dedup_duration = 5 * 60
+# 通知频率限制 [时间(s), 最多通知次数]，超出后暂存，之后合并为一条汇总通知
+notify_rate_limit = [60, 5]
+# 该时间内(s)连续触发的监控合并为一条通知
+notify_batch_window = 1
+# 按涨幅/跌幅/成交额/快速异动排序时只显示排名最前的scanner_top_n只股票，可通过 O/o 切换排序方式
+scanner_top_n = 50
+# 全市场扫描(--scan)的股票代码范围 [市场, 起始代码, 结束代码(不包含)]，不存在的代码接口返回空数据，会被忽略
+scanner_universe = [['sh', 600000, 606000], ['sh', 688000, 689000], ['sz', 0, 4000], ['sz', 300000, 302000]]
+# 自选股分组文件(json，{组名: [股票代码, ...]}，为None时使用tickers)，文件修改后自动重新加载，也可以通过 --watchlist 指定
+watchlist_file = None
+# 是否只按刷新间隔获取当前显示的分组，其他分组每hidden_group_refresh_duration秒获取一次，也可以通过 --visible-only 开启
+watch_visible_group_only = False
+hidden_group_refresh_duration = 60
 # 股票代码
 tickers = [
     'sh000001', # 上证指数
@@ -47,7 +143,6 @@ tickers = [
     '300308', # 中际旭创
     '300502', # 新易盛
     '300284', # 苏交科
-    '300284', # 招商证券
     '300427', # 红相股份
     '300856', # 科思股份
     '600089', # 特变电工
@@ -56,7 +151,6 @@ tickers = [
     '002268', # 电科网安
     '002439', # 启明星辰
     '688682', # 霍莱沃
-    '002268', # 电科网安
 ]
 
 
@@ -72,7 +166,15 @@ palette = [
     ('price monitor button', 'dark green', ''),
     ('fluctuation monitor button', 'dark red', ''),
     ('cancel monitor button', 'dark red', ''),
-    ('1m', 'bold', ''),
+    ('timings button', 'dark magenta', ''),
+    ('sort button', 'dark cyan', ''),
+    ('group button', 'dark blue', ''),
+    ('table header', 'bold', ''),
+    ('rise', 'dark red', ''),
+    ('fall', 'dark green', ''),
+    ('selected', '', 'dark blue'),
+    ('rise selected', 'dark red', 'dark blue'),
+    ('fall selected', 'dark green', 'dark blue'),
 ]
 
 # 默认菜单
@@ -82,6 +184,9 @@ default_menu = [
     u'翻页(', ('page button', u'PgUp/PgDn/↑/↓'), ') | ',
     u'彩色显示(', ('palette button', u'C/c'), ') | ',
     u'选择(', ('select button', u'S/s'), ') | ',
+    u'耗时(', ('timings button', u'T/t'), ') | ',
+    u'排序(', ('sort button', u'O/o'), ') | ',
+    u'分组(', ('group button', u'G/g'), ') | ',
     u'退出进程(', ('quit button', u'Q/q'), ')',
 ]
 # 二级菜单
@@ -97,79 +202,103 @@ secondary_menu = [
 
 # 数据刷新定时器
 urwid_alarm = None
+# 界面容器，由build_ui()创建(无界面模式和作为库导入时不创建)
 # 顶部文本容器
-header_text = urwid.Text(u'实时数据')
-header = urwid.AttrMap(header_text, 'titlebar')
+header_text = None
 # 数据展示容器
-quote_text = urwid.Text(u'按下 (R/r) 以获取数据...')
-quote_filler = urwid.Filler(quote_text, valign='top', top=1, bottom=1)
-quote_box = urwid.Scrollable(quote_filler)
+quote_text = None
+quote_filler = None
+# 数据表格(QuoteTable)，有数据后替换quote_filler显示在quote_box中
+quote_table = None
+quote_box = None
 # 底部菜单容器
-menu = urwid.Text(default_menu)
+menu = None
 # 底部输入框容器
-footer_input = urwid.Edit(u'')
+footer_input = None
 # 布局容器
-layout = urwid.Frame(header=header, body=quote_box, footer=menu)
+layout = None
+# 主循环
+main_loop = None
+# 自动刷新的调度(RefreshScheduler)
+scheduler = None
+# 每年的交易日集合 {年份: set(date)}，第一次用到某一年时生成，chinese_calendar不支持的年份为None
+trading_days = {}
+
+# 数据刷新的后台线程(同一时间只有一个请求在进行中，重叠的刷新请求会合并到该请求)
+fetch_thread = None
+# 后台线程最近一次获取完成的数据快照(请求失败时为异常对象)，由主循环取走后置为None
+latest_snapshot = None
+# 保护latest_snapshot的锁
+snapshot_lock = threading.Lock()
+# 后台线程通知主循环数据已就绪的管道
+fetch_pipe = None
+# 复用的http会话(连接池 + keep-alive)
+http_session = None
+# 并发请求各批次数据的线程池
+batch_executor = None
+# 数据记录器(TickRecorder)
+tick_recorder = None
+# 回放数据源(ReplaySource)
+replay_source = None
+# 共享行情hub的数据源(HubClient)
+hub_source = None
+# 分片进程的数据源(ShardedSource)
+shard_source = None
+# 定期保存检查点(Checkpointer)
+checkpointer = None
 
 # 上一次请求的时间
 last_request_time = ''
-# 上一次请求的股价数据
+# 上一次请求的股价数据{股票代码: Quote}
 last_price = {}
-# 当前股票列表(之所以不使用全局变量tickers，是因为在刷新数据时，结果和tickers可能不一致)
+# 每只股票最近一次数据的指纹{股票代码: hash(数据)}，用于跳过没有变化的股票
+quote_fingerprints = {}
+# 最近一次请求中数据发生变化和没有变化的股票数量
+changed_count = 0
+unchanged_count = 0
+# 发送的对冲请求(包括失败后的重新请求)总数
+hedged_count = 0
+# 接口的熔断器(CircuitBreaker)
+fetch_breaker = None
+# 列式存储的股票数据及派生指标(QuoteStore)
+quote_store = None
+# 每只股票当日的分时数据(IntradayHistory)
+intraday_history = None
+# 分钟K线和成交均价(BarAggregator)
+bar_aggregator = None
+# 自选股分组(Watchlist)
+watchlist = None
+# 重新加载自选股文件失败时的错误信息
+watchlist_error = None
+# 当前分组中已有数据的股票列表(之所以不使用全局变量tickers，是因为在刷新数据时，结果和tickers可能不一致)
 stock_list = []
+# 每种排序方式的排行榜{排序方式: Leaderboard}，每次刷新都会更新，切换排序时直接显示
+leaderboards = None
+# 当前的排序方式(sort_modes中的下标)
+sort_mode = 0
 # 当前菜单状态 main_menu/secondary_menu/price_monitor_menu/fluctuation_monitor_menu
 menu_status = 'main_menu'
 # 当前选择的股票
 current_selected_stock = ''
-# 股票监控数据(用来计算涨跌幅异动){股票代码: [stock_data, stock_data, ...]}
+# 股票监控数据(用来计算涨跌幅异动){股票代码: [RollingWindow, RollingWindow, ...]}，每个阈值对应一个时间窗口
 price_monitor_data = {}
-# 股票异动数据(用来显示的数据){股票代码: [stock, fluctuation, time]}
+# 股票异动数据(用来显示的数据){股票代码: [stock, fluctuation, time, timestamp, window]}
 fluctuation_monitor_data = {}
-# 用户自定义监控数据{股票代码: [monitor_price, monitor_fluctuation]} 当价格或涨跌幅跨过设置的值时触发
+# 持仓组合(Portfolio)
+portfolio = None
+# 用户自定义监控数据{股票代码: AlertBook} 当价格或涨跌幅跨过设置的值时触发，每只股票可设置任意多个值
 custom_monitor_data = {}
-# 已触发的自定义监控数据(用来显示的数据){股票代码: [stock, price, fluctuation, time]}
+# 最近一次触发的自定义监控数据(用来显示的数据){股票代码: [stock, price, fluctuation, time]}
 custom_monitor_triggered_data = {}
-
-
-"""
-构建ansi调色板
-30-37: 前景色
-40-47: 背景色
-可单独存在，也可组合使用
-eg: 
-31m: 红色前景 ('31m', 'dark red', '')
-42m: 绿色背景 ('42m', '', 'dark green')
-31;42m: 红色前景 + 绿色背景 ('31;42m', 'dark red', 'dark green')
-"""
-def build_ansi_palette():
-    color_map = {
-        '30': 'black',
-        '31': 'dark red',
-        '32': 'dark green',
-        '33': 'yellow',
-        '34': 'dark blue',
-        '35': 'dark magenta',
-        '36': 'dark cyan',
-        '37': 'white',
-        '40': 'black',
-        '41': 'dark red',
-        '42': 'dark green',
-        '43': 'brown',
-        '44': 'dark blue',
-        '45': 'dark magenta',
-        '46': 'dark cyan',
-        '47': 'light gray',
-    }
-    ansi_palette = []
-    for i in range(30, 38):
-        ansi_palette.append((f'{i}m', color_map[str(i)], ''))  # 前景色
-    for i in range(40, 48):
-        ansi_palette.append((f'{i}m', '', color_map[str(i)])) # 背景色
-    # 组合出所有可能的前景色和背景色
-    for i in range(30, 38):
-        for j in range(40, 48):
-            ansi_palette.append((f'{i};{j}m', color_map[str(i)], color_map[str(j)]))
-    return ansi_palette
+# 监控事件(异动/自定义监控触发)的接收函数列表，参数为事件dict
+# 界面模式下为通知队列(NotificationDispatcher)，无界面模式下将事件写为json行
+event_listeners = []
+# 通知队列(NotificationDispatcher)
+notification_dispatcher = None
+# 各阶段耗时的统计(StageTimings)
+stage_timings = None
+# 本次刷新的开始时间(time.perf_counter)，用于统计从发起请求到界面更新完成的总耗时
+refresh_start_time = None
 
 
 """
@@ -191,120 +320,1872 @@ def build_ansi_palette():
 (22, 23), (24, 25), (26, 27), (28, 29) 卖二、卖三、卖四、卖五的申请数(股)和报价
 30: 日期
 31: 时间
+32: 状态
+33: 时间戳(由日期和时间解析得到，仅在解析时计算一次)
 """
+# 解析后的股票数据，字段顺序与接口一致，可以通过下标或字段名访问
+# 1-29 为数值(float)，30-32 为字符串，33 为数值时间戳(s)
+Quote = namedtuple('Quote', [
+    'name', 'open', 'pre_close', 'price', 'high', 'low', 'bid', 'ask', 'volume', 'amount',
+    'bid1_volume', 'bid1', 'bid2_volume', 'bid2', 'bid3_volume', 'bid3', 'bid4_volume', 'bid4', 'bid5_volume', 'bid5',
+    'ask1_volume', 'ask1', 'ask2_volume', 'ask2', 'ask3_volume', 'ask3', 'ask4_volume', 'ask4', 'ask5_volume', 'ask5',
+    'date', 'time', 'status', 'timestamp',
+])
+
+# 日期 -> 当日零点时间戳的缓存(同一批数据的日期几乎都相同，只需解析一次)
+day_start_cache = {}
+# 时间 -> 当日秒数的缓存(最多86400项)
+day_seconds_cache = {}
+
+
+# 将接口中的一条数据解析为Quote，数据为空或格式不正确时返回None
+def parse_quote(payload):
+    fields = payload.split(',')
+    if len(fields) < 32:
+        return None
+    try:
+        date = fields[30]
+        time_str = fields[31]
+        day_start = day_start_cache.get(date)
+        if day_start is None:
+            day_start = time.mktime(time.strptime(date, '%Y-%m-%d'))
+            day_start_cache[date] = day_start
+        day_seconds = day_seconds_cache.get(time_str)
+        if day_seconds is None:
+            day_seconds = int(time_str[0:2]) * 3600 + int(time_str[3:5]) * 60 + int(time_str[6:8])
+            day_seconds_cache[time_str] = day_seconds
+        values = [fields[0]]
+        values.extend(map(float, fields[1:30]))
+    except ValueError:
+        return None
+    values += date, time_str, fields[32] if len(fields) > 32 else '', day_start + day_seconds
+    return tuple.__new__(Quote, values)
+
+
+# 流式解析接口响应，边接收边解析，每条数据只扫描一次
+# 响应中每条数据的格式为 var hq_str_<代码>="<数据>";
+# fingerprints为上一次的数据指纹 {代码: hash(数据)}，与上一次完全相同的数据不再解析，也不出现在结果中
+class QuoteStreamParser:
+
+    def __init__(self, encoding='gb18030', fingerprints=None):
+        self.encoding = encoding
+        self.buffer = b''
+        self.result = {}
+        self.previous = fingerprints if fingerprints is not None else {}
+        # 发生变化的股票的新指纹
+        self.fingerprints = {}
+        # 没有变化的股票数量
+        self.unchanged = 0
+        # 解码和解析的总耗时(s)，不包含等待网络数据的时间
+        self.parse_time = 0.0
+
+    # 输入一段响应数据，解析其中所有完整的记录，不完整的部分留到下一次
+    # 分号不会出现在gb18030多字节字符中，可以直接在字节上切分
+    def feed(self, chunk):
+        buffer = self.buffer + chunk if self.buffer else chunk
+        end = buffer.rfind(b';')
+        if end == -1:
+            self.buffer = buffer
+            return
+        self.parse_records(buffer[:end])
+        self.buffer = buffer[end + 1:]
+
+    # 响应结束，解析剩余的数据
+    def close(self):
+        if self.buffer.strip():
+            self.parse_records(self.buffer)
+        self.buffer = b''
+        return self.result
+
+    def parse_records(self, data):
+        start_time = time.perf_counter()
+        text = data.decode(self.encoding, 'replace')
+        result = self.result
+        previous = self.previous
+        fingerprints = self.fingerprints
+        for record in text.split(';'):
+            equal = record.find('="')
+            if equal == -1:
+                continue
+            start = record.find('hq_str_', 0, equal)
+            if start == -1:
+                continue
+            symbol = record[start + 7:equal]
+            payload = record[equal + 2:record.rfind('"')]
+            fingerprint = hash(payload)
+            if previous.get(symbol) == fingerprint:
+                self.unchanged += 1
+                continue
+            quote = parse_quote(payload)
+            if quote is not None:
+                result[symbol] = quote
+                fingerprints[symbol] = fingerprint
+        self.parse_time += time.perf_counter() - start_time
+
+
+# 记录文件的格式: 16字节文件头 + 连续的定长记录(TICK_DTYPE)
+# 每次快照只记录与上一次相比发生变化的股票，同一次快照的记录具有相同的序号
+TICK_FILE_MAGIC = b'STKTICK1'.ljust(16, b'\0')
+TICK_DTYPE = np.dtype([
+    ('sequence', '<u4'), # 快照序号
+    ('received', '<f8'), # 接收时间(本地时间戳)
+    ('symbol', 'S12'), # 股票代码
+    ('name', 'S32'), # 股票名字(utf-8)
+    ('values', '<f8', (29,)), # 数据中的1-29项
+    ('date', 'S10'),
+    ('time', 'S8'),
+    ('status', 'S4'),
+    ('timestamp', '<f8'),
+])
+
+
+# 将每次获取的数据追加写入记录文件
+class TickRecorder:
+
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        # 追加到已有文件时接着之前的序号
+        self.sequence = 0
+        if exists:
+            records = read_tick_file(path)
+            count = len(records)
+            if count > 0:
+                self.sequence = int(records['sequence'][-1]) + 1
+            del records
+            # 上次写入中断时文件末尾可能留有不完整的记录，先截掉，否则之后追加的记录都会错位
+            os.truncate(path, len(TICK_FILE_MAGIC) + count * TICK_DTYPE.itemsize)
+        self.file = open(path, 'ab')
+        if not exists:
+            self.file.write(TICK_FILE_MAGIC)
+        # 股票代码 -> 上一次记录的数据
+        self.last_quotes = {}
+
+    def write(self, snapshot, received=None):
+        changed = [(symbol, quote) for symbol, quote in snapshot.items() if self.last_quotes.get(symbol) != quote]
+        if len(changed) == 0:
+            return
+        records = quotes_to_records(changed)
+        records['sequence'] = self.sequence
+        records['received'] = received if received is not None else time.time()
+        self.file.write(records.tobytes())
+        self.file.flush()
+        self.last_quotes.update(changed)
+        self.sequence += 1
+
+    def close(self):
+        self.file.close()
+
+
+# 将 [(股票代码, Quote)] 转换为定长记录(TICK_DTYPE)，sequence和received为0
+def quotes_to_records(items):
+    records = np.zeros(len(items), dtype=TICK_DTYPE)
+    if len(records) == 0:
+        return records
+    records['symbol'] = [symbol.encode('ascii', 'replace') for symbol, _ in items]
+    records['name'] = [quote.name.encode('utf-8')[:32] for _, quote in items]
+    records['values'] = [quote[1:30] for _, quote in items]
+    records['date'] = [quote.date.encode('ascii', 'replace') for _, quote in items]
+    records['time'] = [quote.time.encode('ascii', 'replace') for _, quote in items]
+    records['status'] = [quote.status.encode('ascii', 'replace')[:4] for _, quote in items]
+    records['timestamp'] = [quote.timestamp for _, quote in items]
+    return records
+
+
+# 将定长记录转换为 {股票代码: Quote}
+def records_to_quotes(records):
+    rows = zip(records['symbol'].tolist(), records['name'].tolist(), records['values'].tolist(),
+               records['date'].tolist(), records['time'].tolist(), records['status'].tolist(), records['timestamp'].tolist())
+    snapshot = {}
+    for symbol, name, values, date, time_str, status, timestamp in rows:
+        snapshot[symbol.decode('ascii')] = Quote(name.decode('utf-8', 'replace'), *values, date.decode('ascii'), time_str.decode('ascii'), status.decode('ascii'), timestamp)
+    return snapshot
+
+
+# 以内存映射的方式读取记录文件(末尾不完整的记录会被忽略)
+def read_tick_file(path):
+    with open(path, 'rb') as f:
+        if f.read(len(TICK_FILE_MAGIC)) != TICK_FILE_MAGIC:
+            raise ValueError('不是有效的记录文件: {}'.format(path))
+    count = (os.path.getsize(path) - len(TICK_FILE_MAGIC)) // TICK_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=TICK_DTYPE)
+    return np.memmap(path, dtype=TICK_DTYPE, mode='r', offset=len(TICK_FILE_MAGIC), shape=(count,))
+
+
+# 从记录文件中逐个读取快照，用于回放
+class ReplaySource:
+
+    def __init__(self, path, speed=1):
+        self.records = read_tick_file(path)
+        self.speed = speed
+        # 每个快照在记录中的起始位置
+        # 只有文件头的记录文件没有快照
+        sequence = self.records['sequence']
+        if len(sequence) == 0:
+            self.starts = np.zeros(1, dtype=np.intp)
+        else:
+            self.starts = np.concatenate(([0], np.flatnonzero(sequence[1:] != sequence[:-1]) + 1, [len(self.records)])).astype(np.intp)
+        self.frame = 0
+        # 上一个快照的接收时间(读取第一个快照之前为None)
+        self.received = None
+
+    @property
+    def frame_count(self):
+        return len(self.starts) - 1
+
+    @property
+    def finished(self):
+        return self.frame >= self.frame_count
+
+    # 读取下一个快照，返回 {股票代码: Quote}(与实时数据一样只包含发生变化的股票)，回放结束时抛出EOFError
+    def next_snapshot(self):
+        if self.finished:
+            raise EOFError('回放结束')
+        records = self.records[self.starts[self.frame]:self.starts[self.frame + 1]]
+        # 先前进到下一个快照，转换失败时跳过该快照，不会反复读取同一个快照
+        self.received = float(records['received'][0])
+        self.frame += 1
+        return records_to_quotes(records)
+
+    # 距离下一个快照的等待时间(s)
+    def next_delay(self):
+        if self.finished or self.speed <= 0 or self.received is None:
+            return 0
+        return max(float(self.records['received'][self.starts[self.frame]]) - self.received, 0) / self.speed
+
+
+# 检查点文件的格式: 8字节标识 + 8字节文件头长度 + json文件头(补齐到8字节) + 各数据段
+# 文件头中记录各数据段相对于文件头结尾的位置(offset)和记录数(count)，读取时以内存映射的方式访问数据段
+# quotes: 每只股票最后的数据(TICK_DTYPE)；windows: 异动监控时间窗口中的数据(WINDOW_DTYPE)
+# 自定义监控和异动数据较少，直接保存在文件头中
+CHECKPOINT_MAGIC = b'STKCKPT1'
+WINDOW_DTYPE = np.dtype([
+    ('row', '<u4'), # 股票在quotes中的位置
+    ('queue', 'u1'), # 时间窗口的序号 * 2 + (0: 最高价队列, 1: 最低价队列)
+    ('timestamp', '<f8'),
+    ('price', '<f8'),
+])
+
+
+# 复制需要保存的状态(在更新数据的线程中调用，之后在后台线程中写入文件)
+def capture_checkpoint():
+    return {
+        'time': time.time(),
+        'quotes': list(last_price.items()),
+        'windows': [(ticker, [(list(window.max_queue), list(window.min_queue)) for window in windows]) for ticker, windows in price_monitor_data.items()],
+        'fluctuation_monitor_data': {ticker: list(data) for ticker, data in fluctuation_monitor_data.items()},
+        'custom_monitor_data': {ticker: {'price': list(book.prices), 'percent': list(book.percents)} for ticker, book in custom_monitor_data.items()},
+    }
+
+
+# 写入检查点: 先写入临时文件，再替换原来的文件，中途退出时原来的检查点不受影响
+def write_checkpoint(path, state):
+    quotes = quotes_to_records(state['quotes'])
+    quotes['received'] = state['time']
+    rows = {symbol: row for row, (symbol, _) in enumerate(state['quotes'])}
+    entries = []
+    for ticker, queues in state['windows']:
+        row = rows.get(ticker)
+        if row is None or len(queues[0][0]) == 0:
+            continue
+        for i, (max_queue, min_queue) in enumerate(queues):
+            entries += [(row, i * 2, timestamp, price) for timestamp, price in max_queue]
+            entries += [(row, i * 2 + 1, timestamp, price) for timestamp, price in min_queue]
+    windows = np.array(entries, dtype=WINDOW_DTYPE)
+
+    sections = {}
+    offset = 0
+    for name, array in [('quotes', quotes), ('windows', windows)]:
+        sections[name] = {'offset': offset, 'count': len(array)}
+        offset += array.nbytes
+    header = json.dumps({
+        'time': state['time'],
+        'date': date.fromtimestamp(state['time']).isoformat(),
+        # 异动监控的时间窗口，与当前配置不同时不恢复时间窗口中的数据
+        'thresholds': [monitor_threshold] + extra_monitor_thresholds,
+        'sections': sections,
+        'fluctuation_monitor_data': state['fluctuation_monitor_data'],
+        'custom_monitor_data': state['custom_monitor_data'],
+    }, ensure_ascii=False).encode('utf-8')
+    header += b' ' * (-len(header) % 8)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(CHECKPOINT_MAGIC + len(header).to_bytes(8, 'little'))
+        f.write(header)
+        f.write(quotes.tobytes())
+        f.write(windows.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+# 读取检查点，返回 (文件头, {数据段名: 内存映射的数组})
+def read_checkpoint(path):
+    with open(path, 'rb') as f:
+        prefix = f.read(len(CHECKPOINT_MAGIC) + 8)
+        if len(prefix) < len(CHECKPOINT_MAGIC) + 8 or prefix[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+            raise ValueError('不是有效的检查点文件: {}'.format(path))
+        length = int.from_bytes(prefix[len(CHECKPOINT_MAGIC):], 'little')
+        header = json.loads(f.read(length))
+    base = len(prefix) + length
+    sections = {}
+    for name, dtype in [('quotes', TICK_DTYPE), ('windows', WINDOW_DTYPE)]:
+        section = header['sections'][name]
+        if section['count'] == 0:
+            sections[name] = np.zeros(0, dtype=dtype)
+        else:
+            sections[name] = np.memmap(path, dtype=dtype, mode='r', offset=base + section['offset'], shape=(section['count'],))
+    return header, sections
+
+
+# 从检查点恢复状态: 自定义监控总是恢复，最后的数据和异动监控只恢复当日的检查点
+# 恢复的数据不触发监控，之后第一次获取的数据与恢复的数据比较(波动、异动监控的时间窗口、自定义监控的跨越)
+def restore_checkpoint(path):
+    global last_request_time
+
+    header, sections = read_checkpoint(path)
+    for ticker, levels in header['custom_monitor_data'].items():
+        alert_book = custom_monitor_data.setdefault(ticker, AlertBook())
+        for kind in ['price', 'percent']:
+            for level in levels[kind]:
+                alert_book.add(kind, level)
+    if header['date'] != date.today().isoformat():
+        return
+
+    records = sections['quotes']
+    snapshot = records_to_quotes(records)
+    rows = quote_store.update(snapshot)
+    intraday_history.update(quote_store, rows)
+    bar_aggregator.update(quote_store, rows)
+    last_price.update(snapshot)
+    portfolio.update(snapshot)
+
+    windows_data = sections['windows']
+    if header['thresholds'] == [list(threshold) for threshold in [monitor_threshold] + extra_monitor_thresholds] and len(windows_data) > 0:
+        symbols = [symbol.decode('ascii') for symbol in records['symbol'].tolist()]
+        queue_rows = windows_data['row'].tolist()
+        queues = windows_data['queue'].tolist()
+        timestamps = windows_data['timestamp'].tolist()
+        prices = windows_data['price'].tolist()
+        # 同一个队列的数据是连续的
+        keys = windows_data['row'].astype(np.int64) * 256 + windows_data['queue']
+        bounds = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1, [len(keys)])).tolist()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            ticker = symbols[queue_rows[start]]
+            windows = price_monitor_data.get(ticker)
+            if windows is None:
+                windows = [RollingWindow(seconds, threshold) for seconds, threshold in [monitor_threshold] + extra_monitor_thresholds]
+                price_monitor_data[ticker] = windows
+            window = windows[queues[start] // 2]
+            queue = window.max_queue if queues[start] % 2 == 0 else window.min_queue
+            queue.extend(zip(timestamps[start:end], prices[start:end]))
+        for ticker, windows in price_monitor_data.items():
+            data = last_price.get(ticker)
+            if data is not None and data.pre_close != 0 and len(windows[0].max_queue) > 0:
+                quote_store.fluctuation[quote_store.index[ticker]] = windows[0].fluctuation(data.pre_close)[0]
+    fluctuation_monitor_data.update(header['fluctuation_monitor_data'])
+
+    update_stock_list()
+    for leaderboard in leaderboards.values():
+        leaderboard.update(quote_store, rows)
+    last_request_time = datetime.fromtimestamp(header['time']).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# 定期在后台线程中写入检查点，同一时间只有一个写入在进行，上一次还没有写完时推迟到下一次数据更新
+class Checkpointer:
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.last_time = time.monotonic()
+        self.thread = None
+        # 写入成功和失败的次数，最近一次写入失败的错误(写入成功后清除)
+        self.writes = 0
+        self.failures = 0
+        self.error = None
+
+    # 距离上一次保存超过interval时保存(数据更新后调用)
+    def maybe_save(self):
+        if time.monotonic() - self.last_time >= self.interval and (self.thread is None or not self.thread.is_alive()):
+            self.save()
+
+    def save(self):
+        self.last_time = time.monotonic()
+        state = capture_checkpoint()
+        self.thread = threading.Thread(target=self.write, args=(state,), daemon=True, name='checkpoint')
+        self.thread.start()
+
+    def write(self, state):
+        start = time.perf_counter()
+        try:
+            write_checkpoint(self.path, state)
+        # 在后台线程中写入，任何异常都只记录下来，不能让线程静默退出
+        except Exception as e:
+            self.error = e
+            self.failures += 1
+        else:
+            self.writes += 1
+            self.error = None
+        stage_timings.add('checkpoint', time.perf_counter() - start)
+
+    # 退出时保存最后的状态并等待写入完成
+    def close(self):
+        if self.thread is not None:
+            self.thread.join()
+        self.save()
+        self.thread.join()
+
+
+# hub返回的接口错误
+class HubError(Exception):
+    pass
+
+
+# 共享行情hub的订阅端: 连接hub并订阅股票，后台线程接收hub推送的数据
+# 消息为json行: 订阅 {"type": "subscribe", "tickers": [...]}
+# hub推送 {"type": "quotes", "time": ..., "quotes": {股票代码: [Quote的字段]}} 和 {"type": "error", "error": ..., "failures": ...}
+class HubClient:
+
+    def __init__(self, path, symbols):
+        self.path = path
+        self.symbols = symbols
+        self.sock = None
+        self.condition = threading.Condition()
+        # 收到还没有取走的数据(只包含发生变化的股票，多条消息合并)
+        self.pending = {}
+        # 收到的消息数，用于等待下一条消息
+        self.received = 0
+        # hub最近一次获取数据的时间
+        self.time = ''
+        # hub最近一次的接口错误及连续失败次数
+        self.error = None
+        self.failures = 0
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    # 连接hub并订阅，订阅后hub会先推送已有的完整数据
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.sendall((json.dumps({'type': 'subscribe', 'tickers': self.symbols}) + '\n').encode('utf-8'))
+        with self.condition:
+            self.sock = sock
+            self.pending = {}
+        threading.Thread(target=self.read_loop, args=(sock,), daemon=True, name='hub-client').start()
+
+    def read_loop(self, sock):
+        try:
+            for line in sock.makefile('rb'):
+                message = json.loads(line)
+                with self.condition:
+                    if message['type'] == 'quotes':
+                        self.pending.update((symbol, Quote(*fields)) for symbol, fields in message['quotes'].items())
+                        self.time = message['time']
+                        self.error = None
+                        self.failures = 0
+                    elif message['type'] == 'error':
+                        self.error = '{}: {}'.format(message['error'], message['message'])
+                        self.failures = message['failures']
+                    self.received += 1
+                    self.condition.notify_all()
+        except (OSError, ValueError):
+            pass
+        finally:
+            sock.close()
+            with self.condition:
+                if self.sock is sock:
+                    self.sock = None
+                self.condition.notify_all()
+
+    # 等待hub推送下一条消息，返回 {股票代码: Quote}(只包含发生变化的股票)，超时时返回空快照
+    # 与hub断开时重新连接，连接失败时抛出OSError，hub获取数据失败时抛出HubError
+    def next_snapshot(self, timeout=None):
+        if not self.connected:
+            self.connect()
+        with self.condition:
+            received = self.received
+            if len(self.pending) == 0:
+                self.condition.wait_for(lambda: self.received != received or not self.connected, timeout)
+            if len(self.pending) == 0:
+                if not self.connected:
+                    raise ConnectionError('与hub的连接已断开')
+                if self.error is not None and self.received != received:
+                    raise HubError(self.error)
+            snapshot = self.pending
+            self.pending = {}
+            return snapshot
+
+    # 距离下一次获取的时间(s)，连接正常时立即等待下一条消息
+    def next_delay(self):
+        return 0 if self.connected else refresh_duration
+
+    def close(self):
+        sock = self.sock
+        if sock is not None:
+            sock.shutdown(socket.SHUT_RDWR)
+
+
+# hub中的一个订阅终端，数据由单独的线程发送，终端处理不过来时不会阻塞hub
+class HubSubscriber:
+
+    def __init__(self, conn):
+        self.conn = conn
+        # 订阅的股票代码
+        self.symbols = set()
+        # 等待发送的消息(bytes)，None表示结束
+        self.messages = queue.Queue(maxsize=hub_queue_size)
+        self.closed = False
+
+    def send(self, message):
+        try:
+            self.messages.put_nowait((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+        except queue.Full:
+            # 丢弃消息会让终端的数据不完整，直接断开，终端重新连接后会收到完整数据
+            self.close()
+
+    def write_loop(self):
+        while True:
+            data = self.messages.get()
+            if data is None or self.closed:
+                break
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                self.close()
+                break
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.messages.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+# 共享行情的hub: 合并所有终端订阅的股票，每次刷新只请求一次接口，再按各终端的订阅推送发生变化的数据
+class QuoteHub:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.subscribers = []
+        # 每只股票最新的数据，新订阅的终端先收到这些数据
+        self.quotes = {}
+        # 有新的订阅时唤醒获取数据的循环，立即获取还没有数据的股票
+        self.wakeup = threading.Event()
+        self.server = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            # 上一次没有正常退出留下的socket文件，如果还有hub在运行则报错
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+            else:
+                raise RuntimeError('已有hub在运行: {}'.format(self.path))
+            finally:
+                probe.close()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen()
+        threading.Thread(target=self.accept_loop, daemon=True, name='hub-accept').start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break
+            subscriber = HubSubscriber(conn)
+            threading.Thread(target=subscriber.write_loop, daemon=True, name='hub-write').start()
+            threading.Thread(target=self.read_loop, args=(subscriber,), daemon=True, name='hub-read').start()
+
+    def read_loop(self, subscriber):
+        try:
+            for line in subscriber.conn.makefile('rb'):
+                message = json.loads(line)
+                if message['type'] == 'subscribe':
+                    self.subscribe(subscriber, message['tickers'])
+        except (OSError, ValueError):
+            pass
+        finally:
+            subscriber.close()
+            subscriber.conn.close()
+            with self.lock:
+                if subscriber in self.subscribers:
+                    self.subscribers.remove(subscriber)
+
+    # 订阅(替换之前的订阅)，立即推送已有的数据
+    def subscribe(self, subscriber, symbols):
+        with self.lock:
+            subscriber.symbols = set(symbols)
+            if subscriber not in self.subscribers:
+                self.subscribers.append(subscriber)
+            quotes = {symbol: list(self.quotes[symbol]) for symbol in symbols if symbol in self.quotes}
+            subscriber.send({'type': 'quotes', 'time': last_request_time, 'quotes': quotes})
+        self.wakeup.set()
+
+    # 所有终端订阅的股票
+    def symbols(self):
+        with self.lock:
+            symbols = set()
+            for subscriber in self.subscribers:
+                symbols.update(subscriber.symbols)
+        return sorted(symbols)
+
+    # 推送发生变化的数据，没有变化的终端也会收到消息(用于更新数据时间)
+    def publish(self, snapshot):
+        with self.lock:
+            self.quotes.update(snapshot)
+            for subscriber in self.subscribers:
+                quotes = {symbol: list(data) for symbol, data in snapshot.items() if symbol in subscriber.symbols}
+                subscriber.send({'type': 'quotes', 'time': last_request_time, 'quotes': quotes})
+
+    def publish_error(self, error):
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.send({'type': 'error', 'error': type(error).__name__, 'message': str(error), 'failures': fetch_breaker.failures})
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            os.unlink(self.path)
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+
+
+# 分片进程的状态，与数据表一样放在共享内存中
+# 写入数据时sequence先加1(奇数表示正在写入)，写完后再加1，读取前后的sequence相同且为偶数时读到的数据才是完整的
+# 数据表中每一行的sequence为该行最近一次写入完成时分片的sequence
+SHARD_STATE_DTYPE = np.dtype([
+    ('sequence', '<u4'),
+    ('heartbeat', '<f8'), # 最近一次心跳(time.time)
+    ('fetch_time', '<f8'), # 最近一次成功获取数据的时间(time.time)
+    ('fetches', '<u4'), # 成功获取数据的次数
+    ('failures', '<u4'), # 连续失败的次数
+])
+
+
+# 分片进程: 按照刷新调度获取一个分片的股票，将发生变化的股票写入共享内存中的数据表
+# 进程重新启动后指纹为空，第一次获取会重新写入整个分片
+def shard_worker(index, start, stop, symbols, table_name, state_name, config):
+    from multiprocessing import parent_process, shared_memory
+
+    # 退出由主进程负责
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    globals().update(config)
+    table_memory = shared_memory.SharedMemory(table_name)
+    # 共享内存由主进程创建和删除(spawn启动的子进程与主进程共用resource_tracker，重复注册没有影响)
+    state_memory = shared_memory.SharedMemory(state_name)
+    table = np.ndarray(table_memory.size // TICK_DTYPE.itemsize, dtype=TICK_DTYPE, buffer=table_memory.buf)[start:stop]
+    state = np.ndarray(state_memory.size // SHARD_STATE_DTYPE.itemsize, dtype=SHARD_STATE_DTYPE, buffer=state_memory.buf)[index:index + 1]
+    rows = {symbol: row for row, symbol in enumerate(symbols)}
+    query = CompiledQuery(symbols)
+    # 上一次进程在写入过程中退出时sequence为奇数，跳过该序号
+    sequence = int(state['sequence'][0])
+    sequence += sequence % 2
+    parent = parent_process()
+    try:
+        while parent is None or parent.is_alive():
+            state['heartbeat'] = time.time()
+            try:
+                snapshot = get_snapshot(query)
+            except Exception:
+                state['failures'] = fetch_breaker.failures
+            else:
+                changed = [(symbol, quote) for symbol, quote in snapshot.items() if symbol in rows]
+                if len(changed) > 0:
+                    records = quotes_to_records(changed)
+                    records['sequence'] = sequence + 2
+                    records['received'] = time.time()
+                    state['sequence'] = sequence + 1
+                    table[[rows[symbol] for symbol, _ in changed]] = records
+                    sequence += 2
+                    state['sequence'] = sequence
+                state['fetch_time'] = time.time()
+                state['fetches'] += 1
+                state['failures'] = 0
+            # 等待下一次获取，等待期间保持心跳
+            wake_time = time.monotonic() + scheduler.next_delay()
+            while time.monotonic() < wake_time and (parent is None or parent.is_alive()):
+                time.sleep(max(min(wake_time - time.monotonic(), 1), 0))
+                state['heartbeat'] = time.time()
+    finally:
+        del table, state
+        table_memory.close()
+        state_memory.close()
+
+
+# 分片模式的数据源: 将股票平均分给shard_count个进程，从共享内存中读取发生变化的股票
+# 每个分片独立读取，正在写入的分片本次跳过，下一次再读，不会等待较慢的分片
+# 进程退出或卡死(超过shard_stall_timeout没有心跳)时重新启动该分片的进程
+class ShardedSource:
+
+    def __init__(self, symbols, count):
+        import multiprocessing
+        from multiprocessing import shared_memory
+
+        self.symbols = symbols
+        self.count = max(min(count, len(symbols)), 1)
+        # 第i个分片为 symbols[bounds[i]:bounds[i + 1]]
+        self.bounds = [len(symbols) * i // self.count for i in range(self.count + 1)]
+        self.table_memory = shared_memory.SharedMemory(create=True, size=max(len(symbols), 1) * TICK_DTYPE.itemsize)
+        self.state_memory = shared_memory.SharedMemory(create=True, size=self.count * SHARD_STATE_DTYPE.itemsize)
+        self.table = np.ndarray(len(symbols), dtype=TICK_DTYPE, buffer=self.table_memory.buf)
+        self.table[:] = 0
+        self.states = np.ndarray(self.count, dtype=SHARD_STATE_DTYPE, buffer=self.state_memory.buf)
+        self.states[:] = 0
+        # 每个分片已读取的sequence
+        self.read_sequences = [0] * self.count
+        # 每个分片的进程重新启动的次数
+        self.restarts = [0] * self.count
+        # 分片进程中使用的配置(命令行参数修改过的全局变量)
+        self.config = {
+            'quote_url': quote_url,
+            'follow_trading_hours': follow_trading_hours,
+            'refresh_duration': refresh_duration,
+            'fetch_budget': fetch_budget,
+            'enable_hedged_requests': enable_hedged_requests,
+        }
+        # 子进程重新导入本模块，不继承主进程的线程和界面
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = [None] * self.count
+        for index in range(self.count):
+            self.start_worker(index)
+
+    def start_worker(self, index):
+        start, stop = self.bounds[index], self.bounds[index + 1]
+        process = self.context.Process(target=shard_worker, name='shard-{}'.format(index), daemon=True, args=(
+            index, start, stop, self.symbols[start:stop], self.table_memory.name, self.state_memory.name, self.config))
+        # 进程启动(导入模块)期间不算卡死
+        self.states['heartbeat'][index] = time.time()
+        process.start()
+        self.processes[index] = process
+
+    # 重新启动退出或卡死的分片进程
+    def check_workers(self):
+        now = time.time()
+        for index, process in enumerate(self.processes):
+            if process.is_alive() and now - self.states['heartbeat'][index] <= shard_stall_timeout:
+                continue
+            if process.is_alive():
+                process.kill()
+            process.join()
+            self.restarts[index] += 1
+            self.start_worker(index)
+
+    # 读取上一次读取之后发生变化的股票，返回 {股票代码: Quote}
+    def next_snapshot(self):
+        self.check_workers()
+        snapshot = {}
+        for index in range(self.count):
+            sequence = int(self.states['sequence'][index])
+            if sequence % 2 == 1 or sequence == self.read_sequences[index]:
+                continue
+            rows = self.table[self.bounds[index]:self.bounds[index + 1]]
+            records = rows[rows['sequence'] > self.read_sequences[index]]
+            if int(self.states['sequence'][index]) != sequence:
+                # 读取过程中分片写入了新数据，下一次再读
+                continue
+            self.read_sequences[index] = sequence
+            snapshot.update(records_to_quotes(records))
+        return snapshot
+
+    # 所有分片中最近一次获取数据的时间
+    @property
+    def fetch_time(self):
+        return float(self.states['fetch_time'].max())
+
+    # 接口连续失败的分片
+    def failed_shards(self):
+        return [index for index in range(self.count) if self.states['failures'][index] > 0]
+
+    def next_delay(self):
+        return shard_read_interval
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        del self.table, self.states
+        self.table_memory.close()
+        self.table_memory.unlink()
+        self.state_memory.close()
+        self.state_memory.unlink()
+
+
+# 各阶段耗时的统计，每个阶段保留最近timing_samples次的耗时，用于计算p50/p95/最大值
+# 记录一次耗时只是向deque追加一个数，可以在后台线程中调用
+class StageTimings:
+
+    def __init__(self, size=200):
+        self.size = size
+        # 阶段 -> deque(耗时(s))，按第一次记录的顺序显示
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        samples = self.samples.get(stage)
+        if samples is None:
+            samples = self.samples.setdefault(stage, deque(maxlen=self.size))
+        samples.append(seconds)
+
+    # 记录with代码块的耗时
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    # 阶段耗时的百分位数(s)，样本少于min_count次时为None
+    def percentile(self, stage, p, min_count=1):
+        values = sorted(self.samples.get(stage, ()))
+        if len(values) < max(min_count, 1):
+            return None
+        return values[min(int(len(values) * p), len(values) - 1)]
+
+    # {阶段: {count, p50_ms, p95_ms, max_ms}}
+    def summary(self):
+        result = {}
+        for stage, samples in list(self.samples.items()):
+            values = sorted(samples)
+            if len(values) == 0:
+                continue
+            result[stage] = {
+                'count': len(values),
+                'p50_ms': values[len(values) // 2] * 1000,
+                'p95_ms': values[min(int(len(values) * 0.95), len(values) - 1)] * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+        return result
+
+    # 顶部显示的文本
+    def format(self):
+        return ' | '.join('{} {:.1f}/{:.1f}/{:.1f}'.format(stage, item['p50_ms'], item['p95_ms'], item['max_ms']) for stage, item in self.summary().items())
+
+
+# 熔断期间不再请求接口
+class CircuitOpenError(Exception):
+    pass
+
+
+# 接口的熔断器
+# 连续失败failure_threshold次后熔断，reset_duration秒内的请求直接失败(不占用网络和线程)
+# 熔断时间结束后放行一次请求，成功则恢复，失败则重新熔断
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=3, reset_duration=15):
+        self.failure_threshold = failure_threshold
+        self.reset_duration = reset_duration
+        # 连续失败的次数
+        self.failures = 0
+        # 最近一次失败的异常
+        self.last_error = None
+        # 熔断结束的时间(time.monotonic)，没有熔断时为None
+        self.open_until = None
+
+    def allow(self):
+        return self.open_until is None or time.monotonic() >= self.open_until
+
+    # 距离熔断结束的时间(s)
+    def retry_in(self):
+        if self.open_until is None:
+            return 0
+        return max(self.open_until - time.monotonic(), 0)
+
+    def success(self):
+        self.failures = 0
+        self.last_error = None
+        self.open_until = None
+
+    def failure(self, error):
+        self.failures += 1
+        self.last_error = error
+        if self.failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.reset_duration
+
+
 # 获取股票数据
-# 
+# 股票数量超过max_batch_size时拆分为多个批次并发请求，最后合并为{股票代码: 数据}
+# 只返回与上一次相比数据发生变化的股票(第一次获取时为全部股票)
+# 整个请求不超过fetch_budget秒，熔断期间直接抛出CircuitOpenError
+# tickers为预先编译的查询(CompiledQuery)或股票代码列表
 def get_price(tickers):
     global last_request_time
+    global changed_count
+    global unchanged_count
+
+    if not fetch_breaker.allow():
+        raise CircuitOpenError('接口连续失败{}次，{:.0f}s后重试'.format(fetch_breaker.failures, fetch_breaker.retry_in()))
+    start_time = time.perf_counter()
+    query = tickers if isinstance(tickers, CompiledQuery) else CompiledQuery(tickers)
+    try:
+        batch_results = fetch_batches(query.queries, start_time + fetch_budget)
+    except Exception as e:
+        fetch_breaker.failure(e)
+        raise
+    fetch_breaker.success()
 
-    headers = {'referer': 'http://finance.sina.com.cn'}
-    tickerurl = "http://hq.sinajs.cn/list="
-    query_str = ''
-    for ticker in tickers:
-        if str(ticker).startswith('30') or str(ticker).startswith('00') or str(ticker).startswith('15'):
-            query_str += 'sz' + str(ticker) + ','
-        elif str(ticker).startswith('60') or str(ticker).startswith('688'):
-            query_str += 'sh' + str(ticker) + ','
-        else:
-            query_str += ticker + ','
-    url = tickerurl + query_str
-    res = requests.get(url, headers=headers).text
+    result = {}
+    fingerprints = {}
+    unchanged = 0
+    parse_time = 0.0
+    for parser in batch_results:
+        result.update(parser.result)
+        fingerprints.update(parser.fingerprints)
+        unchanged += parser.unchanged
+        parse_time += parser.parse_time
+    # 所有批次都成功后才保存新的指纹(请求失败时这些数据下一次会重新解析)
+    quote_fingerprints.update(fingerprints)
+    changed_count = len(result)
+    unchanged_count = unchanged
+    # fetch为请求的总耗时(包含并发批次中的解析)，parse为所有批次解析耗时之和
+    stage_timings.add('fetch', time.perf_counter() - start_time)
+    stage_timings.add('parse', parse_time)
+
+    last_request_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return result
+
+
+# 批次请求的状态
+class BatchRequest:
+
+    def __init__(self, index, query):
+        self.index = index
+        # url中的股票代码部分
+        self.query = query
+        # 第一个请求的发送时间
+        self.start_time = None
+        # 已发送的请求数和进行中的请求数
+        self.attempts = 0
+        self.running = 0
+
+
+# 并发获取所有批次(CompiledQuery.queries)，按批次顺序返回解析器
+# 1. 进行中的批次不超过max_concurrent_requests个，对冲请求不占用并发数
+# 2. 批次请求超过对冲延迟(最近批次请求耗时的p95)仍未完成时，再发送一个相同的请求，先完成的结果生效
+# 3. 请求失败时如果该批次没有其他进行中的请求，立即重新发送一次，再次失败则整个请求失败
+# 4. 超过deadline仍有批次未完成时抛出TimeoutError，未完成的请求在后台到达deadline后自行结束
+def fetch_batches(batches, deadline):
+    global batch_executor
+    global hedged_count
+
+    if batch_executor is None:
+        # 预留与并发数相同的线程给对冲请求
+        batch_executor = ThreadPoolExecutor(max_workers=max_concurrent_requests * 2, thread_name_prefix='batch')
+    hedge_delay = get_hedge_delay()
+    results = [None] * len(batches)
+    waiting = deque(BatchRequest(i, batch) for i, batch in enumerate(batches))
+    # 已发送、还没有结果的批次
+    active = []
+    # 进行中的请求 future -> BatchRequest
+    futures = {}
+
+    def send(request):
+        request.attempts += 1
+        request.running += 1
+        if request.start_time is None:
+            request.start_time = time.perf_counter()
+        futures[batch_executor.submit(get_batch_price, request.query, deadline)] = request
+
+    while len(waiting) > 0 or len(active) > 0:
+        while len(waiting) > 0 and len(active) < max_concurrent_requests:
+            request = waiting.popleft()
+            send(request)
+            active.append(request)
+        now = time.perf_counter()
+        if now >= deadline:
+            raise TimeoutError('获取数据超时({:g}s)'.format(fetch_budget))
+        wake_time = deadline
+        for request in active:
+            if request.attempts > 1:
+                continue
+            if now >= request.start_time + hedge_delay:
+                send(request)
+                hedged_count += 1
+            else:
+                wake_time = min(wake_time, request.start_time + hedge_delay)
+        # 没有时间预算(fetch_budget为inf)时一直等待
+        done, _ = wait(futures, timeout=wake_time - now if wake_time < float('inf') else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            request = futures.pop(future, None)
+            if request is None:
+                continue
+            request.running -= 1
+            try:
+                results[request.index] = future.result()
+            except Exception:
+                if request.running > 0:
+                    continue
+                if request.attempts > 1:
+                    raise
+                send(request)
+                hedged_count += 1
+                continue
+            stage_timings.add('batch', time.perf_counter() - request.start_time)
+            active.remove(request)
+            # 对冲中较慢的请求不再等待
+            for other in [other for other, owner in futures.items() if owner is request]:
+                del futures[other]
+    return results
+
+
+# 对冲延迟: 最近批次请求耗时的p95
+def get_hedge_delay():
+    if not enable_hedged_requests:
+        return float('inf')
+    p95 = stage_timings.percentile('batch', 0.95, hedge_min_samples)
+    if p95 is None:
+        return hedge_default_delay
+    return max(p95, hedge_min_delay)
+
+
+# 获取单个批次的股票数据，返回解析器(QuoteStreamParser)，query为逗号分隔的股票代码
+# 超过deadline(time.perf_counter)时抛出TimeoutError
+def get_batch_price(query, deadline=None):
+    url = quote_url + query
+    timeout = request_timeout
+    if deadline is not None:
+        remaining = max(deadline - time.perf_counter(), 0.001)
+        timeout = tuple(min(value, remaining) for value in request_timeout)
 
     # 响应的结构如下
     # var hq_str_sz002583="海能达,17.290,17.530,17.550,17.970,16.960,17.540,17.550,255884353,4462582236.680,212300,17.540,240100,17.530,88900,17.520,161100,17.510,1177600,17.500,1011020,17.550,369900,17.560,519500,17.570,280000,17.580,180500,17.590,2024-11-29,15:00:00,00";
     # var hq_str_sz002456="欧菲光,13.380,13.450,13.390,13.630,13.000,13.390,13.400,341289935,4540992553.610,1804500,13.390,1595000,13.380,452900,13.370,370000,13.360,684000,13.350,1537156,13.400,292600,13.410,400500,13.420,139500,13.430,143300,13.440,2024-11-29,15:00:00,00";
-    # 使用正则表达式提取数据
-    splited = res.split(';')
-    result = {}
-    pattern = re.compile(r'var hq_str_(.*)="(.*)"')
-    for s in splited:
-        s = s.strip()
-        match = pattern.match(s)
-        if match:
-            result[match.group(1)] = match.group(2).split(',')
-    
-    last_request_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    return result
+    # 边接收边解析，不等待完整响应
+    with get_http_session().get(url, stream=True, timeout=timeout) as res:
+        res.raise_for_status()
+        parser = QuoteStreamParser(res.encoding or 'gb18030', quote_fingerprints)
+        for chunk in res.iter_content(chunk_size=stream_chunk_size):
+            if deadline is not None and time.perf_counter() > deadline:
+                raise TimeoutError('获取数据超时({:g}s)'.format(fetch_budget))
+            parser.feed(chunk)
+    parser.close()
+    return parser
+
+
+# 获取复用的http会话，所有批次共享同一个连接池，避免每次刷新都重新建立TCP连接
+def get_http_session():
+    global http_session
+
+    if http_session is None:
+        # requests的导入较慢，在第一次请求(后台线程)时才导入，不影响启动时第一帧的显示
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        # 连接池同时容纳正常请求和对冲请求
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent_requests * 2)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update({
+            'referer': 'http://finance.sina.com.cn',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        http_session = session
+    return http_session
+
+
+# 将股票代码转换为接口使用的带交易所前缀的代码
+def to_sina_symbol(ticker):
+    ticker = str(ticker).strip().lower()
+    if ticker.startswith('30') or ticker.startswith('00') or ticker.startswith('15'):
+        return 'sz' + ticker
+    elif ticker.startswith('60') or ticker.startswith('688'):
+        return 'sh' + ticker
+    return ticker
+
+
+# 规范化并去重的股票代码(保持第一次出现的顺序)
+def normalize_tickers(tickers):
+    return list(dict.fromkeys(to_sina_symbol(ticker) for ticker in tickers if str(ticker).strip() != ''))
+
+
+# 预先编译的查询: 规范化并去重后的股票代码，以及按max_batch_size拆分后每个批次url中的股票代码部分
+# 自选股分组在加载时编译一次，每次刷新直接使用
+class CompiledQuery:
+
+    def __init__(self, tickers):
+        self.symbols = normalize_tickers(tickers)
+        self.queries = [','.join(self.symbols[i:i + max_batch_size]) for i in range(0, len(self.symbols), max_batch_size)]
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+# 自选股分组 {组名: CompiledQuery}，表格只显示当前分组，可通过 G/g 切换
+# 从watchlist_file加载时记录文件的修改时间，用于检查文件是否修改
+class Watchlist:
+
+    def __init__(self, groups, path=None, mtime=None):
+        self.groups = {str(name): CompiledQuery(group) for name, group in groups.items()}
+        self.names = list(self.groups)
+        # 所有分组的股票(多个分组中都有的股票只获取一次)
+        self.all = CompiledQuery([symbol for query in self.groups.values() for symbol in query.symbols])
+        self.path = path
+        self.mtime = mtime
+        # 当前显示的分组
+        self.visible = self.names[0]
+
+    # 从json文件加载，格式错误时抛出ValueError
+    @classmethod
+    def load(cls, path):
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, encoding='utf-8') as f:
+            groups = json.load(f)
+        if not isinstance(groups, dict) or len(groups) == 0 or any(not isinstance(group, list) for group in groups.values()):
+            raise ValueError('自选股文件的格式应为 {组名: [股票代码, ...]}: ' + path)
+        return cls(groups, path, mtime)
+
+    def visible_query(self):
+        return self.groups[self.visible]
+
+    # 按刷新间隔获取的股票: 所有分组，只获取当前分组时为当前分组
+    def polled_query(self):
+        return self.visible_query() if watch_visible_group_only else self.all
+
+    # 切换到下一个分组
+    def switch(self):
+        self.visible = self.names[(self.names.index(self.visible) + 1) % len(self.names)]
+
+# 列式存储的股票数据，每个字段一个数组，股票代码 -> 行号的映射在整个会话中保持不变
+# 派生指标同样按行存储，每次刷新只对发生变化的行做一次向量化计算
+class QuoteStore:
+    # 存储的数值字段及其在Quote中的下标
+    fields = ('open', 'pre_close', 'price', 'high', 'low', 'volume', 'amount', 'timestamp')
+    field_getter = itemgetter(*[Quote._fields.index(field) for field in fields])
+    # 派生指标及其类型
+    metrics = {
+        'diff': np.float64,
+        'change': np.float64,
+        'change_percent': np.float64,
+        'high_percent': np.float64,
+        'low_percent': np.float64,
+        'hands': np.int64,
+        'wan': np.int64,
+        # monitor_threshold时间窗口内的涨跌幅(%)，由异动监控写入
+        'fluctuation': np.float64,
+    }
+
+    def __init__(self, capacity=64):
+        # 股票代码 -> 行号
+        self.index = {}
+        # 行号 -> 股票代码
+        self.tickers = []
+        self.size = 0
+        self.columns = {field: np.zeros(capacity) for field in self.fields}
+        # 每只股票上一次获取到的价格(新加入的股票为nan)
+        self.prev_price = np.full(capacity, np.nan)
+        for metric, dtype in self.metrics.items():
+            setattr(self, metric, np.zeros(capacity, dtype=dtype))
+        # 上一次更新的行
+        self.last_rows = np.zeros(0, dtype=np.intp)
+
+    # 获取股票所在的行号，不存在时追加一行
+    def row(self, ticker):
+        row = self.index.get(ticker)
+        if row is None:
+            row = self.size
+            if row == len(self.prev_price):
+                self.grow()
+            self.index[ticker] = row
+            self.tickers.append(ticker)
+            self.size += 1
+        return row
+
+    # 容量不足时将所有数组扩容一倍，新增的行与初始化时一样填充(不能用np.resize，它会重复已有的行)
+    def grow(self):
+        capacity = len(self.prev_price) * 2
+        for field, column in self.columns.items():
+            grown = np.zeros(capacity)
+            grown[:self.size] = column[:self.size]
+            self.columns[field] = grown
+        for metric, dtype in self.metrics.items():
+            grown = np.zeros(capacity, dtype=dtype)
+            grown[:self.size] = getattr(self, metric)[:self.size]
+            setattr(self, metric, grown)
+        prev_price = np.full(capacity, np.nan)
+        prev_price[:self.size] = self.prev_price[:self.size]
+        self.prev_price = prev_price
+
+    # 写入一次快照(只包含发生变化的股票)并重新计算这些股票的派生指标，返回更新的行号
+    def update(self, snapshot):
+        size = self.size
+        # 波动只显示本次发生变化的股票，上一次变化的股票本次没有变化时归零
+        self.diff[self.last_rows] = 0
+        rows = np.fromiter((self.row(ticker) for ticker in snapshot), dtype=np.intp, count=len(snapshot))
+        if len(rows) > 0:
+            self.prev_price[rows] = np.where(rows < size, self.columns['price'][rows], np.nan)
+            values = np.array([self.field_getter(quote) for quote in snapshot.values()], dtype=np.float64)
+            for i, field in enumerate(self.fields):
+                self.columns[field][rows] = values[:, i]
+            self.compute_metrics(rows)
+        self.last_rows = rows
+        return rows
+
+    # 计算指定行的派生指标
+    def compute_metrics(self, rows):
+        price = self.columns['price'][rows]
+        pre_close = self.columns['pre_close'][rows]
+        prev_price = self.prev_price[rows]
+        # 昨收为0(停牌、新股等)时涨跌幅记为0
+        base = np.where(pre_close == 0, np.nan, pre_close)
+
+        # 波动: 与上一次获取相比的价格变化
+        self.diff[rows] = np.round(np.where(np.isnan(prev_price), 0.0, price - prev_price), 3)
+        # 涨跌
+        self.change[rows] = np.round(price - pre_close, 3)
+        # 涨跌幅(%)
+        self.change_percent[rows] = np.nan_to_num(np.round((price - pre_close) / base * 100, 2))
+        # 今日最高/最低涨跌幅(%)
+        self.high_percent[rows] = np.nan_to_num(np.round((self.columns['high'][rows] - pre_close) / base * 100, 2))
+        self.low_percent[rows] = np.nan_to_num(np.round((self.columns['low'][rows] - pre_close) / base * 100, 2))
+        # 成交数(手)、成交额(万)
+        self.hands[rows] = np.rint(self.columns['volume'][rows] / 100)
+        self.wan[rows] = np.rint(self.columns['amount'][rows] / 10000)
+
+
+# 排行榜: 维护某个指标最大的前n行，每次刷新只检查发生变化的行，不对全部股票排序
+# 候选行之外的行的指标都不大于threshold，发生变化的行超过threshold时才加入候选
+# 候选中不低于threshold的行不足n个(排名靠前的股票指标下降)时，用np.argpartition从全部行中重新选出候选
+class Leaderboard:
+
+    def __init__(self, n, key, spare=None):
+        self.n = n
+        # key(store, rows) 返回指定行的指标，指标越大排名越靠前
+        self.key = key
+        # 候选行数为n + spare，超过n + 2 * spare时删除排名靠后的候选
+        self.spare = n if spare is None else spare
+        self.candidates = np.zeros(0, dtype=np.intp)
+        self.threshold = np.inf
+        # 排名前n的行号(按指标从大到小)
+        self.ranking = np.zeros(0, dtype=np.intp)
+        # 重新选出候选的次数
+        self.rebuilds = 0
+
+    # 写入一次快照后更新排名，rows为QuoteStore.update()返回的行号
+    def update(self, store, rows):
+        count = min(self.n, store.size)
+        if len(rows) > 0:
+            rows = rows[~np.isin(rows, self.candidates)]
+            self.candidates = np.concatenate([self.candidates, rows[self.key(store, rows) > self.threshold]])
+        values = self.key(store, self.candidates)
+        if np.count_nonzero(values >= self.threshold) < count:
+            self.rebuild(store)
+            values = self.key(store, self.candidates)
+        elif len(self.candidates) > self.n + 2 * self.spare:
+            keep = np.argpartition(values, len(values) - self.n - self.spare)[len(values) - self.n - self.spare:]
+            self.candidates = self.candidates[keep]
+            values = values[keep]
+            self.threshold = max(self.threshold, values.min())
+        # 指标相同时按行号排序
+        self.ranking = self.candidates[np.lexsort((self.candidates, -values))[:count]]
+
+    # 从全部行中选出指标最大的n + spare行作为候选
+    def rebuild(self, store):
+        self.rebuilds += 1
+        size = store.size
+        limit = self.n + self.spare
+        if size <= limit:
+            self.candidates = np.arange(size, dtype=np.intp)
+            self.threshold = -np.inf
+            return
+        values = self.key(store, slice(0, size))
+        self.candidates = np.argpartition(values, size - limit)[size - limit:].astype(np.intp)
+        self.threshold = values[self.candidates].min()
+
+
+# 表格的排序方式 [名称, 指标]，指标为None时按获取到的顺序显示全部股票，否则只显示排行榜中的股票
+sort_modes = [
+    ['默认', None],
+    ['涨幅', lambda store, rows: store.change_percent[rows]],
+    ['跌幅', lambda store, rows: -store.change_percent[rows]],
+    ['成交额', lambda store, rows: store.columns['amount'][rows]],
+    ['快速异动', lambda store, rows: np.abs(store.fluctuation[rows])],
+]
 
-# 获取更新表格
-def get_update_table(need_update=True):
-    global last_price
-    global stock_list
 
+# 当日交易时间的总时长(s)
+def trading_seconds():
+    return sum((datetime.strptime(end, '%H:%M') - datetime.strptime(start, '%H:%M')).total_seconds() for start, end in trading_sessions)
+
+
+# 交易时段的起止(当日秒数)及对应的累计交易时间(s)，用np.interp将当日秒数映射为已经过的交易时间
+def trading_session_points():
+    seconds = []
+    offsets = []
+    elapsed = 0
+    for start, end in trading_sessions:
+        start_seconds = int(start[:2]) * 3600 + int(start[3:]) * 60
+        end_seconds = int(end[:2]) * 3600 + int(end[3:]) * 60
+        seconds += [start_seconds, end_seconds]
+        offsets += [elapsed, elapsed + end_seconds - start_seconds]
+        elapsed += end_seconds - start_seconds
+    return seconds, offsets
+
+
+# 本地时间与UTC的时差(s)，用于从时间戳计算当日秒数
+def local_utc_offset():
+    return int(datetime.now().astimezone().utcoffset().total_seconds())
+
+
+# 每只股票当日的分时数据(价格、累计成交量、时间戳)，使用固定大小的环形缓冲区
+# 所有股票共用一块按行存储的数组，行号与QuoteStore相同，只有发生变化的股票才写入新数据
+# 每只股票的容量为一个交易日按refresh_duration刷新的数据条数，股票较多时按history_memory_limit减少(只保留最近的数据)
+# 另外按交易时间将当日平均分为sparkline_width段，记录每段最后的价格，用于生成走势列
+class IntradayHistory:
+    # 每条数据的字节数: 价格(float32) + 累计成交量(float64) + 时间戳(uint32)
+    itemsize = 16
+    # 走势使用的字符(从低到高)
+    spark_chars = np.array([ord(c) for c in '▁▂▃▄▅▆▇█'], dtype=np.uint32)
+
+    def __init__(self, capacity=64):
+        self.width = sparkline_width
+        self.utc_offset = local_utc_offset()
+        # 用于将时间映射到走势的分段
+        self.session_seconds, self.session_offsets = trading_session_points()
+        self.capacity = 0
+        self.slots = 0
+        self.allocate(capacity)
+
+    # 分配capacity只股票的空间，每只股票的容量按内存上限计算，已有的数据按时间顺序保留最近的部分
+    def allocate(self, capacity):
+        day_slots = max(int(trading_seconds() / refresh_duration), 1)
+        # 每只股票固定占用的内存: 走势分段(float32)和走势字符串(每个字符4字节)，写入位置、数据条数和日期
+        row_bytes = self.width * 8 + 20
+        slots = max(min(day_slots, (history_memory_limit // capacity - row_bytes) // self.itemsize), 1)
+        price = np.full((capacity, slots), np.nan, dtype=np.float32)
+        volume = np.zeros((capacity, slots))
+        timestamp = np.zeros((capacity, slots), dtype=np.uint32)
+        head = np.zeros(capacity, dtype=np.intp)
+        count = np.zeros(capacity, dtype=np.intp)
+        day = np.full(capacity, -1, dtype=np.int32)
+        buckets = np.full((capacity, self.width), np.nan, dtype=np.float32)
+        sparklines = np.full(capacity, '', dtype='<U{}'.format(self.width))
+
+        old = self.capacity
+        if old > 0:
+            keep = min(self.slots, slots)
+            rows = np.arange(old)[:, None]
+            order = (self.head[:, None] - keep + np.arange(keep)) % self.slots
+            price[:old, :keep] = self.price[rows, order]
+            volume[:old, :keep] = self.volume[rows, order]
+            timestamp[:old, :keep] = self.timestamp[rows, order]
+            head[:old] = keep % slots
+            count[:old] = np.minimum(self.count, keep)
+            day[:old] = self.day
+            buckets[:old] = self.buckets
+            sparklines[:old] = self.sparklines
+
+        self.capacity = capacity
+        self.slots = slots
+        self.price = price
+        self.volume = volume
+        self.timestamp = timestamp
+        # 每只股票下一条数据的写入位置和已有的数据条数
+        self.head = head
+        self.count = count
+        # 每只股票数据所属的日期(自1970-01-01起的天数)
+        self.day = day
+        self.buckets = buckets
+        self.sparklines = sparklines
+
+    # 占用的内存(字节)
+    @property
+    def nbytes(self):
+        arrays = [self.price, self.volume, self.timestamp, self.head, self.count, self.day, self.buckets, self.sparklines]
+        return sum(array.nbytes for array in arrays)
+
+    # 按时间顺序返回一只股票当日的分时数据 (价格, 累计成交量, 时间戳)
+    def samples(self, row):
+        count = self.count[row]
+        order = (self.head[row] - count + np.arange(count)) % self.slots
+        return self.price[row, order], self.volume[row, order], self.timestamp[row, order]
+
+    # 写入QuoteStore中本次更新的行
+    def update(self, store, rows):
+        if len(store.prev_price) > self.capacity:
+            self.allocate(len(store.prev_price))
+        if len(rows) == 0:
+            return
+        price = store.columns['price'][rows]
+        timestamp = store.columns['timestamp'][rows]
+        local_time = timestamp.astype(np.int64) + self.utc_offset
+
+        # 新的交易日清空之前的数据
+        day = (local_time // 86400).astype(np.int32)
+        new_day = day != self.day[rows]
+        if new_day.any():
+            reset = rows[new_day]
+            self.head[reset] = 0
+            self.count[reset] = 0
+            self.buckets[reset] = np.nan
+            self.day[reset] = day[new_day]
+
+        head = self.head[rows]
+        self.price[rows, head] = price
+        self.volume[rows, head] = store.columns['volume'][rows]
+        self.timestamp[rows, head] = timestamp
+        self.head[rows] = (head + 1) % self.slots
+        self.count[rows] = np.minimum(self.count[rows] + 1, self.slots)
+
+        # 更新走势: 只有当前时间所在的分段发生变化
+        offset = np.interp(local_time % 86400, self.session_seconds, self.session_offsets)
+        bucket = np.minimum((offset / self.session_offsets[-1] * self.width).astype(np.intp), self.width - 1)
+        self.buckets[rows, bucket] = price
+        self.render_sparklines(rows)
+
+    # 生成指定行的走势字符串，没有数据的分段沿用前一段的价格，当前时间之后的分段为空白
+    def render_sparklines(self, rows):
+        buckets = self.buckets[rows]
+        columns = np.arange(self.width)
+        index = np.where(np.isnan(buckets), 0, columns)
+        np.maximum.accumulate(index, axis=1, out=index)
+        filled = np.take_along_axis(buckets, index, axis=1)
+        blank = np.isnan(filled) | (columns > index[:, -1:])
+        values = np.where(blank, np.nan, filled)
+
+        low = np.nanmin(values, axis=1, keepdims=True)
+        high = np.nanmax(values, axis=1, keepdims=True)
+        span = np.where(high > low, high - low, 1)
+        # 全天价格不变时显示在中间
+        level = np.where(high > low, np.rint((values - low) / span * 7), 3)
+        codes = self.spark_chars[np.nan_to_num(level).astype(np.intp)]
+        codes[blank] = ord(' ')
+        self.sparklines[rows] = np.ascontiguousarray(codes).view('<U{}'.format(self.width))[:, 0]
+
+
+# 由连续快照的成交量和成交额增量生成的K线(OHLCV)，每个周期只保存当前和上一根K线，数组的行号与QuoteStore相同
+# 每次刷新只处理发生变化的股票，每只股票每个周期O(1)，同时维护全天的成交均价(VWAP)
+class BarAggregator:
+    fields = ('start', 'open', 'high', 'low', 'close', 'volume', 'amount')
+
+    def __init__(self, capacity=64):
+        self.timeframes = list(bar_timeframes)
+        self.utc_offset = local_utc_offset()
+        self.session_seconds, self.session_offsets = trading_session_points()
+        # 最新的数据时间戳
+        self.market_time = 0.0
+        # 本次更新中完成的K线 {周期: 行号数组}，完成的K线在last中
+        self.completed = {}
+        self.capacity = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        shape = (len(self.timeframes), capacity)
+        # 当前和上一根K线，start为K线的开始时间戳(没有K线时为nan)
+        current = {field: np.full(shape, np.nan) for field in self.fields}
+        last = {field: np.full(shape, np.nan) for field in self.fields}
+        # 上一次的累计成交量和成交额
+        prev_volume = np.full(capacity, np.nan)
+        prev_amount = np.full(capacity, np.nan)
+        vwap = np.full(capacity, np.nan)
+
+        old = self.capacity
+        if old > 0:
+            for field in self.fields:
+                current[field][:, :old] = self.current[field]
+                last[field][:, :old] = self.last[field]
+            prev_volume[:old] = self.prev_volume
+            prev_amount[:old] = self.prev_amount
+            vwap[:old] = self.vwap
+
+        self.capacity = capacity
+        self.current = current
+        self.last = last
+        self.prev_volume = prev_volume
+        self.prev_amount = prev_amount
+        self.vwap = vwap
+
+    # 写入QuoteStore中本次更新的行
+    def update(self, store, rows):
+        if len(store.prev_price) > self.capacity:
+            self.allocate(len(store.prev_price))
+        self.completed = {}
+        if len(rows) == 0:
+            return
+        price = store.columns['price'][rows]
+        volume = store.columns['volume'][rows]
+        amount = store.columns['amount'][rows]
+        timestamp = store.columns['timestamp'][rows]
+        self.market_time = max(self.market_time, timestamp.max())
+
+        # 成交量和成交额的增量，第一次出现或累计值减少(新的交易日)时没有增量
+        volume_delta = volume - self.prev_volume[rows]
+        amount_delta = amount - self.prev_amount[rows]
+        invalid = np.isnan(volume_delta) | (volume_delta < 0) | (amount_delta < 0)
+        volume_delta[invalid] = 0
+        amount_delta[invalid] = 0
+        self.prev_volume[rows] = volume
+        self.prev_amount[rows] = amount
+        # 全天的成交均价即累计成交额/累计成交量
+        self.vwap[rows] = np.where(volume > 0, amount / np.where(volume > 0, volume, 1), np.nan)
+
+        local_time = timestamp + self.utc_offset
+        current = self.current
+        for i, timeframe in enumerate(self.timeframes):
+            start = local_time - local_time % timeframe - self.utc_offset
+            current_start = current['start'][i, rows]
+            # 进入新的周期: 当前K线完成，开始新的K线(时间早于当前K线的数据不处理)
+            roll = np.isnan(current_start) | (start > current_start)
+            same = start == current_start
+
+            done = rows[roll & ~np.isnan(current_start)]
+            if len(done) > 0:
+                for field in self.fields:
+                    self.last[field][i, done] = current[field][i, done]
+                self.completed[timeframe] = done
+
+            new = rows[roll]
+            if len(new) > 0:
+                current['start'][i, new] = start[roll]
+                for field in ('open', 'high', 'low', 'close'):
+                    current[field][i, new] = price[roll]
+                current['volume'][i, new] = volume_delta[roll]
+                current['amount'][i, new] = amount_delta[roll]
+
+            rows_same = rows[same]
+            if len(rows_same) > 0:
+                current['high'][i, rows_same] = np.maximum(current['high'][i, rows_same], price[same])
+                current['low'][i, rows_same] = np.minimum(current['low'][i, rows_same], price[same])
+                current['close'][i, rows_same] = price[same]
+                current['volume'][i, rows_same] += volume_delta[same]
+                current['amount'][i, rows_same] += amount_delta[same]
+
+    # 最小周期内当前K线的成交量，以及与当日平均每个周期成交量的比值(量比)，当前周期没有成交时为0
+    def period_volume(self, row, volume):
+        timeframe = self.timeframes[0]
+        start = self.current['start'][0, row]
+        market_start = self.market_time - (self.market_time + self.utc_offset) % timeframe
+        if np.isnan(start) or start < market_start:
+            return 0.0, 0.0
+        period_volume = self.current['volume'][0, row].item()
+        elapsed = np.interp((self.market_time + self.utc_offset) % 86400, self.session_seconds, self.session_offsets)
+        periods = max(elapsed / timeframe, 1)
+        average = volume / periods
+        return period_volume, float(period_volume / average) if average > 0 else 0.0
+
+    # 完成的K线 {股票代码: {start, open, high, low, close, volume, amount}}
+    def completed_bars(self, store, timeframe):
+        i = self.timeframes.index(timeframe)
+        bars = {}
+        for row in self.completed.get(timeframe, []).tolist():
+            bar = {field: self.last[field][i, row].item() for field in self.fields}
+            bar['start'] = datetime.fromtimestamp(bar['start']).strftime('%Y-%m-%d %H:%M')
+            bars[store.tickers[row]] = bar
+        return bars
+
+
+# 格式化价格(接口中的价格均为3位小数)
+def format_price(price):
+    return '{:.3f}'.format(price)
+
+
+# 格式化监控值，过多时只显示前几个
+def format_levels(levels, suffix='', limit=3):
+    text = ','.join(str(level) + suffix for level in levels[:limit])
+    if len(levels) > limit:
+        text += '…(+{})'.format(len(levels) - limit)
+    return text
+
+
+# 写入新的数据快照，更新监控数据
+def update_quotes(tickers_data):
+    # 更新自定义监控数据(需要在更新last_price之前，用于比较新旧价格)
+    with stage_timings.measure('alert'):
+        update_custom_monitor_data(last_price, tickers_data)
+    with stage_timings.measure('store'):
+        rows = quote_store.update(tickers_data)
+        intraday_history.update(quote_store, rows)
+        bar_aggregator.update(quote_store, rows)
+        count = len(last_price)
+        last_price.update(tickers_data)
+        # 有新的股票时更新当前股票列表(快照可能只包含重点股票)
+        if len(last_price) != count:
+            update_stock_list()
+    # 更新监控数据
+    with stage_timings.measure('monitor'):
+        update_monitor_data(tickers_data)
+    # 更新持仓市值
+    with stage_timings.measure('portfolio'):
+        portfolio.update(tickers_data)
+    # 更新所有排序方式的排行榜(需要在异动监控之后，快速异动使用异动监控的涨跌幅)
+    with stage_timings.measure('rank'):
+        for leaderboard in leaderboards.values():
+            leaderboard.update(quote_store, rows)
+
+
+# 更新当前股票列表: 当前分组中已有数据的股票，按分组中的顺序(回放时为记录中的全部股票)
+def update_stock_list():
+    global stock_list
 
-    table = Table(show_header=True, header_style=None)
-
-    table.add_column("股票", justify='center')
-    table.add_column("昨收", justify='center')
-    table.add_column("今开", justify='center')
-    table.add_column("实时", justify='center')
-    table.add_column("波动", justify='center')
-    table.add_column("涨跌", justify='center')
-    table.add_column("涨跌幅", justify='center')
-    table.add_column("今日最高", justify='center')
-    table.add_column("今日最低", justify='center')
-    table.add_column("成交数(手)", justify='center')
-    table.add_column("成交额(万)", justify='center')
-    table.add_column("时间", justify='center')
-    table.add_column("监控价格", justify='center')
-    table.add_column("监控涨跌幅", justify='center')
-
-    temp_last_price = last_price.copy()
-    tickers_data = []
-    if need_update:
-        tickers_data = get_price(tickers)
+    if replay_source is not None:
+        stock_list = list(last_price)
     else:
-        tickers_data = last_price
-    temp_stock_list = []
-    for ticker, data in tickers_data.items():
+        stock_list = [symbol for symbol in watchlist.visible_query().symbols if symbol in last_price]
+
+
+# 重新加载修改后的自选股文件，保留当前分组，下一次刷新获取全部股票
+# 文件不完整或格式错误时继续使用原来的分组，在顶部显示错误，文件再次修改后重新加载
+def reload_watchlist():
+    global watchlist
+    global watchlist_error
+
+    if watchlist.path is None:
+        return
+    try:
+        mtime = os.stat(watchlist.path).st_mtime_ns
+        if mtime == watchlist.mtime:
+            return
+        watchlist.mtime = mtime
+        new_watchlist = Watchlist.load(watchlist.path)
+    except (OSError, ValueError) as e:
+        watchlist_error = str(e)
+        return
+    if watchlist.visible in new_watchlist.groups:
+        new_watchlist.visible = watchlist.visible
+    watchlist = new_watchlist
+    watchlist_error = None
+    update_stock_list()
+    scheduler.force_full = True
+
+
+# 表格列名
+table_columns = ['股票', '昨收', '今开', '实时', '波动', '涨跌', '涨跌幅', '走势', '均价偏离', '今日最高', '今日最低', '成交数(手)', '成交额(万)', '分钟量(手)', '时间', '监控价格', '监控涨跌幅']
+# 有持仓时追加的列
+portfolio_columns = ['持仓', '市值', '当日盈亏', '持仓盈亏', '仓位']
+
+
+# 直接生成urwid文本的数据表格，同时作为ListBox的数据源(ListWalker)
+# 行控件只在ListBox需要显示时才生成，每行缓存一个Text控件，只有内容、颜色或选中状态发生变化的行才会重新渲染
+# 列宽只增不减，列宽变化后其余行在下一次显示时重新渲染
+class QuoteTable(urwid.ListWalker):
+
+    def __init__(self, columns, row_source):
+        self.columns = columns
+        # row_source(ticker) 返回 (key, make_row, args)，make_row(*args) 返回 (cells, style)
+        self.row_source = row_source
+        self.widths = [text_width(column) for column in columns]
+        # 列宽的版本号，每次列宽变化时加一
+        self.layout_version = 0
+        self.header = urwid.Text('', wrap='clip')
+        self.divider = urwid.Text('', wrap='clip')
+        # 股票代码 -> [key, cells, style, urwid.Text, layout_version]
+        self.rows = {}
+        # 当前显示的股票顺序及股票代码 -> 位置的索引
+        self.order = []
+        self.positions = {}
+        self.focus = 0
+        self.listbox = urwid.ListBox(self)
+        self.widget = urwid.Frame(self.listbox, header=urwid.Pile([urwid.Divider(), self.header, self.divider]))
+        self.render_header()
+
+    # 设置显示顺序，顺序不变时不重建索引
+    def set_order(self, tickers):
+        if tickers != self.order:
+            self.order = list(tickers)
+            self.positions = {ticker: i for i, ticker in enumerate(self.order)}
+            self.focus = min(self.focus, max(len(self.order) - 1, 0))
+        self._modified()
+
+    # 数据变化后通知ListBox重新绘制，只有可见的行会被重新生成
+    def invalidate(self):
+        self._modified()
+
+    # 股票所在的位置，不存在时返回None
+    def position(self, ticker):
+        return self.positions.get(ticker)
+
+    # 获取某一行的控件，key与上一次相同且列宽未变化时直接返回缓存的控件
+    def row_widget(self, ticker):
+        key, make_row, args = self.row_source(ticker)
+        row = self.rows.get(ticker)
+        if row is None:
+            row = [None, None, None, urwid.Text('', wrap='clip'), -1]
+            self.rows[ticker] = row
+        if row[0] != key:
+            cells, style = make_row(*args)
+            row[0], row[1], row[2] = key, cells, style
+            if self.fit(cells):
+                self.layout_version += 1
+                self.render_header()
+            self.render_row(row)
+        elif row[4] != self.layout_version:
+            self.render_row(row)
+        return row[3]
+
+    # ListWalker接口
+    def __getitem__(self, position):
+        if not 0 <= position < len(self.order):
+            raise IndexError(position)
+        return self.row_widget(self.order[position])
+
+    def next_position(self, position):
+        if position + 1 >= len(self.order):
+            raise IndexError(position)
+        return position + 1
+
+    def prev_position(self, position):
+        if position <= 0:
+            raise IndexError(position)
+        return position - 1
+
+    def get_focus(self):
+        if len(self.order) == 0:
+            return None, None
+        return self[self.focus], self.focus
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_next(self, position):
         try:
-            # 股票波动值
-            diff = 0.0
-            if last_price.get(ticker) is not None:
-                diff = float(data[3]) - float(last_price[ticker][3])
-
-            color = 'red' if float(data[3]) - float(data[2]) > 0 else 'green' if float(data[3]) - float(data[2]) < 0 else None
-            bg_color = 'blue' if ticker == current_selected_stock and use_palette is True else None
-            pre_text = '● ' if ticker == current_selected_stock and menu_status in ['secondary_menu', 'price_monitor_menu', 'fluctuation_monitor_menu'] and use_palette is False else ''
-            
-            custom_monitor_price = ''
-            custom_monitor_fluctuation = ''
-            
-            if custom_monitor_data.get(ticker) is not None:
-                custom_monitor_price = str(custom_monitor_data[ticker][0]) if custom_monitor_data[ticker][0] is not None else ''
-                custom_monitor_fluctuation = str(custom_monitor_data[ticker][1]) + '%' if custom_monitor_data[ticker][1] is not None else ''
-            
-            table.add_row(
-                pre_text + data[0].strip() + ' ' + ticker, # 股票名字
-                str(data[2]), # 昨收
-                str(data[1]), # 今开
-                str(data[3]), # 实时
-                ('+' if diff > 0 else '') + str(round(diff, 3)), # 波动
-                ('+' if float(data[3]) - float(data[2]) > 0 else '') + str(round(float(data[3]) - float(data[2]), 3)), # 涨跌
-                str(round((float(data[3]) - float(data[2])) / float(data[2]) * 100, 2)) + '%', # 涨跌幅
-                str(data[4]) + ' · ' + str(round((float(data[4]) - float(data[2])) / float(data[2]) * 100, 2)) + '%', # 今日最高
-                str(data[5]) + ' · ' + str(round((float(data[5]) - float(data[2])) / float(data[2]) * 100, 2)) + '%', # 今日最低
-                str(round(float(data[8]) / 100)), # 成交数(手)
-                str(round(float(data[9]) / 10000)), # 成交额(万)
-                str(data[31]), # 时间
-                custom_monitor_price, # 监控价格
-                custom_monitor_fluctuation, # 监控涨跌幅
-                style=Style(color=color, bgcolor=bg_color)
-            )
-
-            # 更新上一次的股价数据
-            last_price[ticker] = data
-            temp_stock_list.append(ticker)
-        except Exception as e:
-            continue
-    # 更新监控数据
-    update_monitor_data()
-    # 更新自定义监控数据
-    update_custom_monitor_data(temp_last_price, last_price)
-    # 更新当前股票列表
-    stock_list = temp_stock_list
-    
-    return table
+            position = self.next_position(position)
+            return self[position], position
+        except IndexError:
+            return None, None
+
+    def get_prev(self, position):
+        try:
+            position = self.prev_position(position)
+            return self[position], position
+        except IndexError:
+            return None, None
+
+    # 根据单元格内容扩展列宽，返回列宽是否发生变化
+    def fit(self, cells):
+        changed = False
+        for i, cell in enumerate(cells):
+            width = text_width(cell)
+            if width > self.widths[i]:
+                self.widths[i] = width
+                changed = True
+        return changed
+
+    def format_line(self, cells, separator='│'):
+        parts = []
+        for cell, width in zip(cells, self.widths):
+            padding = width - text_width(cell)
+            parts.append(' ' * (padding // 2) + cell + ' ' * (padding - padding // 2))
+        return separator + ' ' + (' ' + separator + ' ').join(parts) + ' ' + separator
+
+    def render_header(self):
+        self.header.set_text(('table header', self.format_line(self.columns)))
+        self.divider.set_text('├' + '┼'.join('─' * (width + 2) for width in self.widths) + '┤')
+
+    def render_row(self, row):
+        text = self.format_line(row[1])
+        row[3].set_text((row[2], text) if row[2] is not None else text)
+        row[4] = self.layout_version
+
+
+# 文本在终端中的显示宽度(中文字符占两列)
+def text_width(text):
+    return urwid.calc_width(text, 0, len(text))
+
+
+# 获取更新表格(tickers_data为新的数据快照，为None时使用上一次的数据更新表格)
+# 只更新数据和显示顺序，行的格式化在显示时按需进行
+def get_update_table(tickers_data=None):
+    if tickers_data is not None:
+        update_quotes(tickers_data)
+    quote_table.set_order(get_display_order())
+    return quote_table.widget
+
+
+# 当前排序方式下显示的股票顺序，只对当前显示的分组排序
+# 分组包含全部股票时(全市场扫描、只有一个分组)直接使用排行榜，否则对分组中的股票排序(分组中的股票数量较少)
+def get_display_order():
+    name, key = sort_modes[sort_mode]
+    if key is None:
+        return stock_list
+    if len(stock_list) == quote_store.size:
+        return [quote_store.tickers[row] for row in leaderboards[name].ranking.tolist()]
+    rows = np.fromiter((quote_store.index[ticker] for ticker in stock_list), dtype=np.intp, count=len(stock_list))
+    # 指标相同时按行号排序，与排行榜一致
+    ranking = rows[np.lexsort((rows, -key(quote_store, rows)))[:scanner_top_n]]
+    return [quote_store.tickers[row] for row in ranking.tolist()]
+
+
+# 表格行的数据源，返回 (key, make_row, args)
+# key为行的缓存键: 数据、波动值、选中状态和监控值都不变时该行不需要重新渲染
+def get_table_row(ticker):
+    data = last_price[ticker]
+    row = quote_store.index[ticker]
+    diff = quote_store.diff[row].item()
+    # 选中的股票: 启用调色板时使用背景色，否则在名字前加标记
+    mark = ''
+    if ticker == current_selected_stock:
+        mark = 'palette' if use_palette is True else '● ' if menu_status in ['secondary_menu', 'price_monitor_menu', 'fluctuation_monitor_menu'] else ''
+
+    custom_monitor_price = ''
+    custom_monitor_fluctuation = ''
+    if custom_monitor_data.get(ticker) is not None:
+        custom_monitor_price = format_levels(custom_monitor_data[ticker].prices)
+        custom_monitor_fluctuation = format_levels(custom_monitor_data[ticker].percents, '%')
+
+    sparkline = str(intraday_history.sparklines[row])
+    # 当前分钟的成交量在数据没有变化时也会归零，需要作为缓存键的一部分
+    period_volume = bar_aggregator.period_volume(row, data.volume)
+
+    # 持仓列(仓位随持仓总市值变化)
+    holding = portfolio.format_row(ticker) if len(portfolio.positions) > 0 else ()
+
+    key = (data, diff, sparkline, period_volume, mark, custom_monitor_price, custom_monitor_fluctuation, holding)
+    return key, make_table_row, (ticker, data, row, diff, sparkline, period_volume, mark, custom_monitor_price, custom_monitor_fluctuation, holding)
+
+
+# 生成表格中的一行，返回 (cells, style)
+def make_table_row(ticker, data, row, diff, sparkline, period_volume, mark, custom_monitor_price, custom_monitor_fluctuation, holding):
+    change = quote_store.change[row].item()
+    vwap = bar_aggregator.vwap[row].item()
+    vwap_deviation = ''
+    if not np.isnan(vwap) and vwap != 0 and abs(data.price - vwap) / vwap < 0.5:
+        # 指数的成交额与成交量不对应，偏离超过50%时不显示
+        vwap_deviation = '{:+.2f}%'.format((data.price - vwap) / vwap * 100)
+    volume, ratio = period_volume
+    color = 'rise' if change > 0 else 'fall' if change < 0 else None
+    style = color
+    if mark == 'palette':
+        style = color + ' selected' if color is not None else 'selected'
+    pre_text = mark if mark != 'palette' else ''
+    cells = [
+        pre_text + data.name.strip() + ' ' + ticker, # 股票名字
+        format_price(data.pre_close), # 昨收
+        format_price(data.open), # 今开
+        format_price(data.price), # 实时
+        ('+' if diff > 0 else '') + str(diff), # 波动
+        ('+' if change > 0 else '') + str(change), # 涨跌
+        str(quote_store.change_percent[row].item()) + '%', # 涨跌幅
+        sparkline, # 走势
+        vwap_deviation, # 均价偏离
+        format_price(data.high) + ' · ' + str(quote_store.high_percent[row].item()) + '%', # 今日最高
+        format_price(data.low) + ' · ' + str(quote_store.low_percent[row].item()) + '%', # 今日最低
+        str(quote_store.hands[row].item()), # 成交数(手)
+        str(quote_store.wan[row].item()), # 成交额(万)
+        '{} ×{:.1f}'.format(round(volume / 100), ratio) if volume > 0 else '0', # 分钟量(手)
+        data.time, # 时间
+        custom_monitor_price, # 监控价格
+        custom_monitor_fluctuation, # 监控涨跌幅
+        *holding, # 持仓
+    ]
+    return cells, style
 
 
 # 监听键盘输入
@@ -314,14 +2195,18 @@ def handle_input(key):
 
     if key == 'R' or key == 'r': # 刷新
         if menu_status == 'main_menu':
-            quote_text.set_text('获取数据中，请等待...')
+            # 已有数据时保留当前表格，等待后台数据就绪后再更新
+            if len(last_price) == 0:
+                show_message('获取数据中，请等待...')
+                main_loop.draw_screen()
+            scheduler.force_full = True
             refresh(main_loop, '')
 
     elif key == 'Q' or key == 'q': # 退出
         if urwid_alarm is not None:
             main_loop.remove_alarm(urwid_alarm)
         
-        quote_text.set_text('正在退出，请稍后...')
+        show_message('正在退出，请稍后...')
         main_loop.draw_screen()
         raise urwid.ExitMainLoop()
 
@@ -351,14 +2236,39 @@ def handle_input(key):
                 main_loop.screen.register_palette(palette_empty)
             
             header_text.set_text('')
-            quote_text.set_text('')
+            show_message('')
             menu.set_text('')
             main_loop.draw_screen()
             
-            refresh(main_loop, '')
+            redraw()
             menu.set_text(default_menu)
             main_loop.draw_screen()
 
+    elif key == 'T' or key == 't': # 切换耗时显示
+        global show_timings
+        if menu_status == 'main_menu':
+            show_timings = not show_timings
+            update_header()
+
+    elif key == 'O' or key == 'o': # 切换排序方式
+        global sort_mode
+        if menu_status == 'main_menu':
+            sort_mode = (sort_mode + 1) % len(sort_modes)
+            # 回到表格顶部
+            quote_table.set_focus(0)
+            redraw()
+
+    elif key == 'G' or key == 'g': # 切换自选股分组
+        if menu_status == 'main_menu' and len(watchlist.names) > 1:
+            watchlist.switch()
+            update_stock_list()
+            quote_table.set_focus(0)
+            redraw()
+            # 只获取当前分组时立即获取新分组的数据
+            if watch_visible_group_only and polls_upstream():
+                scheduler.force_full = True
+                refresh(main_loop, '')
+
     elif key == 'S' or key == 's': # 选择股票
         # 只有在主菜单时才能进入选择股票
         if menu_status == 'main_menu':
@@ -376,14 +2286,14 @@ def handle_input(key):
             menu_status = 'main_menu'
             menu.set_text(default_menu)
             main_loop.draw_screen()
-            refresh(main_loop, '')
+            redraw()
         if menu_status == 'price_monitor_menu' or menu_status == 'fluctuation_monitor_menu':
             menu_status = 'secondary_menu'
             menu.set_text(secondary_menu)
             layout.set_footer(menu)
             layout.set_focus('body')
             main_loop.draw_screen()
-            refresh(main_loop, '')
+            redraw()
 
     elif key == 'left': # 上一个股票
         if menu_status == 'secondary_menu':
@@ -396,7 +2306,7 @@ def handle_input(key):
     elif key == 'P' or key == 'p': # 价格监控
         if menu_status == 'secondary_menu':
             menu_status = 'price_monitor_menu'
-            footer_input.set_caption(u'价格监控 | 返回(Esc) | 确认(Enter) | 请输入要监控的价格: ')
+            footer_input.set_caption(u'价格监控 | 返回(Esc) | 确认(Enter) | 请输入要监控的价格(多个用逗号分隔，留空清除): ')
             footer_input.set_edit_text(u'')
             footer_input.set_edit_pos(len(footer_input.get_edit_text()))
             layout.set_footer(footer_input)
@@ -406,7 +2316,7 @@ def handle_input(key):
     elif key == 'F' or key == 'f': # 涨跌幅监控
         if menu_status == 'secondary_menu':
             menu_status = 'fluctuation_monitor_menu'
-            footer_input.set_caption(u'涨跌幅监控 | 返回(Esc) | 确认(Enter) | 请输入要监控的涨跌幅(%): ')
+            footer_input.set_caption(u'涨跌幅监控 | 返回(Esc) | 确认(Enter) | 请输入要监控的涨跌幅(%)(多个用逗号分隔，留空清除): ')
             footer_input.set_edit_text(u'')
             footer_input.set_edit_pos(len(footer_input.get_edit_text()))
             layout.set_footer(footer_input)
@@ -419,123 +2329,402 @@ def handle_input(key):
                 custom_monitor_data.pop(current_selected_stock)
                 update_header()
                 main_loop.draw_screen()
-                refresh(main_loop, '')
+                redraw()
 
     elif key == 'enter': # 确认输入
         if menu_status == 'price_monitor_menu' or menu_status == 'fluctuation_monitor_menu':
             # 如果没有初始化，则初始化
             if custom_monitor_data.get(current_selected_stock) is None:
-                custom_monitor_data[current_selected_stock] = [None, None]
-            value = footer_input.get_edit_text()
+                custom_monitor_data[current_selected_stock] = AlertBook()
+            alert_book = custom_monitor_data[current_selected_stock]
+            values = [value.strip() for value in footer_input.get_edit_text().replace('，', ',').split(',') if value.strip() != '']
             # 判断是否为数字
-            result = re.compile(r'^-?\d+(\.\d+)?$').match(value)
-            if value != '' and result is None:
+            pattern = re.compile(r'^-?\d+(\.\d+)?$')
+            if any(pattern.match(value) is None for value in values):
                 footer_input.set_edit_text(u'')
                 return
-            if menu_status == 'price_monitor_menu':
-                custom_monitor_data[current_selected_stock][0] = float(value) if value != '' else None
-                update_header()
-            elif menu_status == 'fluctuation_monitor_menu':
-                custom_monitor_data[current_selected_stock][1] = float(value) if value != '' else None
-                update_header()
+            kind = 'price' if menu_status == 'price_monitor_menu' else 'percent'
+            # 留空则清除该类监控，否则追加监控值
+            if len(values) == 0:
+                alert_book.clear(kind)
+            for value in values:
+                alert_book.add(kind, float(value))
+            if alert_book.is_empty():
+                custom_monitor_data.pop(current_selected_stock)
+            update_header()
             # 返回二级菜单
             menu_status = 'secondary_menu'
             menu.set_text(secondary_menu)
             layout.set_footer(menu)
             layout.set_focus('body')
             main_loop.draw_screen()
-            refresh(main_loop, '')
+            redraw()
 
-# 切换选中的股票
+# 切换选中的股票(按表格中显示的顺序)
 def switch_stock(next=False):
     global current_selected_stock
-    global stock_list
     global last_price
 
-    if next:
-        if current_selected_stock == '':
-            current_selected_stock = stock_list[0] if len(stock_list) > 0 else ''
-        else:
-            current_selected_stock = stock_list[(stock_list.index(current_selected_stock) + 1) % len(stock_list)]
-    else:
-        if current_selected_stock == '':
-            current_selected_stock = stock_list[-1] if len(stock_list) > 0 else ''
-        else:
-            current_selected_stock = stock_list[(stock_list.index(current_selected_stock) - 1) % len(stock_list)]
+    order = quote_table.order
+    if len(order) == 0:
+        return
+    start_time = time.perf_counter()
+    position = quote_table.position(current_selected_stock)
+    if position is None:
+        position = -1 if next else 0
+    position = (position + (1 if next else -1)) % len(order)
+    current_selected_stock = order[position]
 
     update_header()
-    quote_box.set_scrollpos(stock_list.index(current_selected_stock))
-    console = Console(record=True)
-    table = get_update_table(False)
-
-    with console.capture() as capture:
-        console.print(table)
-    quote_text.set_text(ansi_str_to_urwid(capture.get()))
+    # 滚动到选中的股票，只有可见的行会重新渲染
+    quote_table.set_focus(position)
+    render_table(quote_table.widget)
     
     main_loop.draw_screen()
+    stage_timings.add('switch', time.perf_counter() - start_time)
 
 
-# 将ansi样式转换为urwid样式
-def ansi_str_to_urwid(ansi):
-    # 查找所有ansi控制字符的位置
-    ansi_positions = [i for i in range(len(ansi)) if ansi[i] == '\033']
-
-    urwid_text_tuple = []
-    pre_pos = 0
-    pre_style = None
-    # 遍历所有控制字符，将其转换为urwid样式
-    for i in range(len(ansi_positions)):
-        pos = ansi_positions[i]
-        m_index = ansi.find('m', pos)
-        # 获取控制字符的值，如 0m, 1m
-        ansi_code = ansi[pos + 2:m_index + 1]
-        
-        if ansi[pre_pos:pos] == '' or ansi[pre_pos:pos].strip() == '' or pre_style is None:
-            urwid_text_tuple.append(u"{}".format(ansi[pre_pos:pos]))
+# 将表格显示到数据面板
+def render_table(table):
+    quote_box.original_widget = table
+
+
+# 在数据面板显示提示信息
+def show_message(text):
+    quote_text.set_text(text)
+    quote_box.original_widget = quote_filler
+
+
+# 使用上一次的数据重新绘制数据面板(不发起网络请求)
+def redraw():
+    if len(last_price) > 0:
+        render_table(get_update_table())
+    update_header()
+    main_loop.draw_screen()
+
+
+# 是否为交易日(周一至周五且不是节假日)
+def is_trading_day(day):
+    if day.year not in trading_days:
+        trading_days[day.year] = get_trading_days(day.year)
+    days = trading_days[day.year]
+    if days is None:
+        # 超出chinese_calendar支持的年份时只按周末判断
+        return day.isoweekday() <= 5
+    return day in days
+
+
+# 生成一年中所有交易日的集合(工作日中除去周末调休的上班日)
+def get_trading_days(year):
+    import chinese_calendar
+
+    try:
+        return set(chinese_calendar.get_workdays(date(year, 1, 1), date(year, 12, 31), include_weekends=False))
+    except NotImplementedError:
+        return None
+
+
+# 距离下一个交易时段开始的时间(s)，交易时段内为0
+def seconds_until_trading(now):
+    for days in range(15):
+        day = (now + timedelta(days=days)).date()
+        if not is_trading_day(day):
+            continue
+        for start, end in trading_sessions:
+            start_time = datetime.combine(day, datetime.strptime(start, '%H:%M').time())
+            end_time = datetime.combine(day, datetime.strptime(end, '%H:%M').time())
+            if now < end_time:
+                return max((start_time - now).total_seconds(), 0)
+    return 24 * 3600
+
+
+# 自动刷新的调度
+# 1. 休市(午休、收盘后、非交易日)时不请求数据，等到下一个交易时段开始
+# 2. 接口的数据时间不再更新时逐次延长刷新间隔，数据时间更新后恢复
+# 3. 重点股票每次刷新都获取，其余股票每cold_refresh_duration秒随重点股票一起获取一次
+# 4. 只获取当前分组时，其他分组每hidden_group_refresh_duration秒获取一次
+class RefreshScheduler:
+
+    def __init__(self):
+        # 上一次获取全部股票(只获取当前分组时为当前分组)的时间(time.monotonic)
+        self.last_full_refresh = None
+        # 上一次获取所有分组的时间
+        self.last_all_refresh = None
+        # 下一次刷新需要获取全部股票(手动刷新)
+        self.force_full = False
+        # 接口返回的最新数据时间戳
+        self.feed_time = 0.0
+        # 数据时间连续没有更新的次数
+        self.stale_count = 0
+        # 本次刷新是否只获取重点股票
+        self.hot_only = False
+        # 距离下一个交易时段开始的时间(s)，交易时段内为0
+        self.market_wait = 0
+        # 本次刷新的股票数量和下一次刷新的间隔，用于显示
+        self.batch_size = 0
+        self.delay = refresh_duration
+
+    # 重点股票: 当前选择、设置了自定义监控、持有和正在异动的股票
+    def hot_tickers(self):
+        hot = set(custom_monitor_data)
+        hot.update(portfolio.positions)
+        hot.update(fluctuation_monitor_data)
+        if current_selected_stock != '':
+            hot.add(current_selected_stock)
+        return sorted(hot)
+
+    # 本次刷新需要获取的股票，空列表表示本次不需要请求
+    # 第一次刷新和手动刷新总是获取全部股票(休市时也会获取一次，用于显示收盘数据)
+    def next_batch(self):
+        now = time.monotonic()
+        full = watchlist.polled_query()
+        if self.last_all_refresh is None:
+            self.last_all_refresh = now
+        if self.last_full_refresh is None or self.force_full:
+            batch = full
+        elif follow_trading_hours and self.update_market_wait() > 0:
+            batch = []
+        elif now - self.last_all_refresh >= hidden_group_refresh_duration - refresh_duration / 2:
+            batch = watchlist.all
+        elif now - self.last_full_refresh >= cold_refresh_duration - refresh_duration / 2:
+            batch = full
         else:
-            urwid_text_tuple.append((pre_style, u"{}".format(ansi[pre_pos:pos])))
-        
-        if ansi_code == '0m':
-            pre_style = None
+            batch = self.hot_tickers()
+        if batch is full or batch is watchlist.all:
+            self.last_full_refresh = now
+            self.force_full = False
+        if batch is watchlist.all:
+            self.last_all_refresh = now
+        self.hot_only = batch is not full and batch is not watchlist.all
+        self.batch_size = len(batch)
+        return batch
+
+    # 获取到数据后检查接口的数据时间是否更新
+    # 重点股票只有几只，停牌或成交稀少时经常没有变化，只获取重点股票时不计为数据没有更新
+    def observe(self, snapshot):
+        feed_time = max((data.timestamp for data in snapshot.values()), default=0.0)
+        if feed_time > self.feed_time:
+            self.feed_time = feed_time
+            self.stale_count = 0
+        elif not self.hot_only:
+            self.stale_count += 1
+
+    def update_market_wait(self):
+        self.market_wait = seconds_until_trading(datetime.now()) if follow_trading_hours else 0
+        return self.market_wait
+
+    # 距离下一次刷新的时间(s)
+    def next_delay(self):
+        if self.update_market_wait() > 0:
+            # 最多等待10分钟后重新检查(避免系统休眠或修改时间后错过开盘)
+            self.delay = min(self.market_wait, 600)
+        elif self.stale_count > 1:
+            # 刷新和接口更新的时间不同步时偶尔会有一次没有更新，连续两次没有更新才延长间隔
+            self.delay = min(refresh_duration * 2 ** (self.stale_count - 1), max_backoff_duration)
         else:
-            pre_style = ansi_code
-        pre_pos = m_index + 1
-    # 添加最后一个
-    urwid_text_tuple.append(u"{}".format(ansi[pre_pos:]))
-
-    return urwid_text_tuple
+            self.delay = refresh_duration
+        return self.delay
 
 
-# 刷新数据面板
+# 刷新数据面板(数据在后台线程中获取，就绪后由on_snapshot_ready更新界面)
 def refresh(_loop, _data):    
     global urwid_alarm
-    global auto_refresh
+    global refresh_start_time
 
     if urwid_alarm is not None:
         main_loop.remove_alarm(urwid_alarm)
-    
-    console = Console(record=True)
-    table = get_update_table()
+        urwid_alarm = None
+
+    # 已有请求在进行中时合并到该请求，请求完成后会重新安排刷新
+    # 必须在选出批次之前判断，否则会消耗全量刷新的标记和时间而该批次并不会被请求
+    if fetch_thread is not None and fetch_thread.is_alive():
+        return
+    reload_watchlist()
+    batch = scheduler.next_batch() if polls_upstream() else None
+    if batch is not None and len(batch) == 0:
+        # 休市中或者没有需要获取的重点股票，等待下一次刷新
+        update_header()
+        schedule_refresh()
+        return
+    refresh_start_time = time.perf_counter()
+    request_snapshot(batch)
+
+
+# 按照调度设置下一次自动刷新
+def schedule_refresh():
+    global urwid_alarm
 
-    with console.capture() as capture:
-        console.print(table)
+    if auto_refresh and urwid_alarm is None and (replay_source is None or not replay_source.finished):
+        delay = get_next_delay()
+        urwid_alarm = main_loop.set_alarm_in(delay, refresh)
 
-    update_header()
-    quote_text.set_text(ansi_str_to_urwid(capture.get()))
-    
-    main_loop.draw_screen()
-    # 如果开启自动刷新，则继续刷新
-    if auto_refresh:
-        urwid_alarm = main_loop.set_alarm_in(refresh_duration, refresh)
+
+# 是否由本进程按照刷新调度请求接口(回放、hub和分片模式下数据来自记录文件或其他进程)
+def polls_upstream():
+    return replay_source is None and hub_source is None and shard_source is None
+
+
+# 距离下一次刷新的时间(s)，连接hub时数据由hub推送，获取完成后立即等待下一次推送
+def get_next_delay():
+    if replay_source is not None:
+        return replay_source.next_delay()
+    if hub_source is not None:
+        return hub_source.next_delay()
+    if shard_source is not None:
+        return shard_source.next_delay()
+    return scheduler.next_delay()
+
+
+# 发起后台数据请求，如果已有请求在进行中，则合并到该请求中
+def request_snapshot(batch=None):
+    global fetch_thread
+
+    if fetch_thread is not None and fetch_thread.is_alive():
+        return
+    fetch_thread = threading.Thread(target=fetch_snapshot, args=(batch,), daemon=True)
+    fetch_thread.start()
+
+
+# 获取一次数据快照，回放模式下从记录文件中读取，连接hub时等待hub推送，分片模式下从共享内存读取，否则请求实时数据(并按需记录)
+# batch为本次需要获取的股票，为None时获取全部股票
+def get_snapshot(batch=None):
+    global last_request_time
+    global changed_count
+    global unchanged_count
+
+    if replay_source is not None:
+        snapshot = replay_source.next_snapshot()
+        last_request_time = datetime.fromtimestamp(replay_source.received).strftime('%Y-%m-%d %H:%M:%S')
+        return snapshot
+    if hub_source is not None:
+        # hub没有推送时最多等待max_backoff_duration秒，之后更新一次界面
+        snapshot = hub_source.next_snapshot(max_backoff_duration)
+        last_request_time = hub_source.time
+        changed_count = len(snapshot)
+        unchanged_count = max(len(hub_source.symbols) - changed_count, 0)
+        if tick_recorder is not None:
+            tick_recorder.write(snapshot)
+        return snapshot
+    if shard_source is not None:
+        snapshot = shard_source.next_snapshot()
+        if shard_source.fetch_time > 0:
+            last_request_time = datetime.fromtimestamp(shard_source.fetch_time).strftime('%Y-%m-%d %H:%M:%S')
+        changed_count = len(snapshot)
+        unchanged_count = max(len(shard_source.symbols) - changed_count, 0)
+        if tick_recorder is not None:
+            tick_recorder.write(snapshot)
+        return snapshot
+    snapshot = get_price(watchlist.all if batch is None else batch)
+    scheduler.observe(snapshot)
+    if tick_recorder is not None:
+        tick_recorder.write(snapshot)
+    return snapshot
+
+
+# 后台线程: 获取数据并通知主循环
+def fetch_snapshot(batch=None):
+    global latest_snapshot
+
+    try:
+        snapshot = get_snapshot(batch)
+    except Exception as e:
+        snapshot = e
+    # 快照只包含发生变化的股票，这些变化在交出快照之前已经提交(数据指纹、分片序号、hub缓存)
+    # 因此未被取走的旧快照要与新快照合并(新数据优先)，否则其中的变化不会再次出现；获取失败时直接替换
+    with snapshot_lock:
+        if isinstance(snapshot, dict) and isinstance(latest_snapshot, dict):
+            latest_snapshot = {**latest_snapshot, **snapshot}
+        else:
+            latest_snapshot = snapshot
+    os.write(fetch_pipe, b'1')
+
+
+# 主循环: 后台数据就绪后更新界面
+def on_snapshot_ready(_data):
+    global latest_snapshot
+
+    with snapshot_lock:
+        snapshot = latest_snapshot
+        latest_snapshot = None
+
+    # 如果开启自动刷新，则继续刷新(先设置下一次刷新，顶部显示新的刷新间隔)
+    schedule_refresh()
+    if snapshot is not None:
+        if isinstance(snapshot, EOFError):
+            update_header()
+        elif isinstance(snapshot, CircuitOpenError):
+            update_header_text()
+        elif isinstance(snapshot, Exception):
+            update_header_text()
+            header_text.set_text(header_text.get_text()[0] + u' | 获取数据失败: {}'.format(type(snapshot).__name__))
+        else:
+            render_table(get_update_table(snapshot))
+            with stage_timings.measure('header'):
+                update_header_text()
+            if checkpointer is not None:
+                checkpointer.maybe_save()
+        # 表格中可见的行在这里生成和渲染
+        with stage_timings.measure('draw'):
+            main_loop.draw_screen()
+        if refresh_start_time is not None:
+            stage_timings.add('refresh', time.perf_counter() - refresh_start_time)
+
+    # 返回True以保持管道打开
+    return True
 
 
 # 更新顶部文本
-def update_header():
+def update_header_text():
     global auto_refresh
     global last_request_time
     global current_selected_stock
 
-    header_text.set_text(u'实时数据 | 刷新间隔: {}s | 刷新于: {}'.format(refresh_duration, last_request_time))
+    if replay_source is not None:
+        header_text.set_text(u'回放数据 | 回放速度: {}x | 进度: {}/{} | 数据时间: {}'.format(replay_source.speed, replay_source.frame, replay_source.frame_count, last_request_time))
+        if replay_source.finished:
+            header_text.set_text(header_text.get_text()[0] + u' | 回放结束')
+    elif shard_source is not None:
+        header_text.set_text(u'分片数据 | 进程数: {} | 刷新于: {}'.format(shard_source.count, last_request_time))
+        failed = shard_source.failed_shards()
+        if len(failed) > 0:
+            header_text.set_text(header_text.get_text()[0] + u' | 数据已过期(分片{}接口失败)'.format(','.join(str(index) for index in failed)))
+        if sum(shard_source.restarts) > 0:
+            header_text.set_text(header_text.get_text()[0] + u' | 进程重启: {}次'.format(sum(shard_source.restarts)))
+        header_text.set_text(header_text.get_text()[0] + u' | 变化: {}/{}'.format(changed_count, changed_count + unchanged_count))
+    elif hub_source is not None:
+        header_text.set_text(u'共享数据 | hub: {} | 刷新于: {}'.format(hub_source.path, last_request_time))
+        if not hub_source.connected:
+            header_text.set_text(header_text.get_text()[0] + u' | 未连接hub')
+        elif hub_source.failures > 0:
+            header_text.set_text(header_text.get_text()[0] + u' | 数据已过期(接口连续失败{}次)'.format(hub_source.failures))
+        header_text.set_text(header_text.get_text()[0] + u' | 变化: {}/{}'.format(changed_count, changed_count + unchanged_count))
+    else:
+        header_text.set_text(u'实时数据 | 刷新间隔: {:g}s | 刷新于: {}'.format(scheduler.delay, last_request_time))
+        # 接口失败时表格中是最后一次成功获取的数据
+        if fetch_breaker.failures > 0:
+            header_text.set_text(header_text.get_text()[0] + u' | 数据已过期(接口连续失败{}次{})'.format(
+                fetch_breaker.failures, '，{:.0f}s后重试'.format(fetch_breaker.retry_in()) if not fetch_breaker.allow() else ''))
+        if scheduler.market_wait > 0:
+            header_text.set_text(header_text.get_text()[0] + u' | 休市中，{}后自动刷新'.format((datetime.now() + timedelta(seconds=scheduler.market_wait)).strftime('%m-%d %H:%M')))
+        elif scheduler.stale_count > 1:
+            header_text.set_text(header_text.get_text()[0] + u' | 数据未更新')
+        if 0 < scheduler.batch_size < len(watchlist.all):
+            header_text.set_text(header_text.get_text()[0] + u' | 本次获取: {}/{}'.format(scheduler.batch_size, len(watchlist.all)))
+        header_text.set_text(header_text.get_text()[0] + u' | 变化: {}/{}'.format(changed_count, changed_count + unchanged_count))
+    # 有多个分组时显示当前分组
+    if len(watchlist.names) > 1:
+        header_text.set_text(header_text.get_text()[0] + u' | 分组: {}({}/{})'.format(
+            watchlist.visible, watchlist.names.index(watchlist.visible) + 1, len(watchlist.names)))
+    if watchlist_error is not None:
+        header_text.set_text(header_text.get_text()[0] + u' | 自选股文件加载失败: {}'.format(watchlist_error))
+    # 后台线程中保存检查点和发送通知的失败
+    if checkpointer is not None and checkpointer.error is not None:
+        header_text.set_text(header_text.get_text()[0] + u' | 检查点保存失败: {}'.format(type(checkpointer.error).__name__))
+    if notification_dispatcher is not None and notification_dispatcher.failures > 0:
+        header_text.set_text(header_text.get_text()[0] + u' | 通知发送失败: {}次'.format(notification_dispatcher.failures))
+    # 按排行榜排序时显示排序方式
+    if sort_modes[sort_mode][1] is not None:
+        header_text.set_text(header_text.get_text()[0] + u' | 排序: {}前{}'.format(sort_modes[sort_mode][0], scanner_top_n))
     # 如果自动刷新关闭，则显示已暂停自动刷新
     if auto_refresh is False:
         header_text.set_text(header_text.get_text()[0] + u' | 已暂停自动刷新')
@@ -546,88 +2735,302 @@ def update_header():
     if enable_price_monitor and len(fluctuation_monitor_data) > 0:
         fluctuation_text = ''
         for ticker, data in fluctuation_monitor_data.items():
-            fluctuation_text += '{}({}): {}{}% | '.format(data[0], data[2], '+' if data[1] > 0 else '',round(data[1], 2))
+            fluctuation_text += '{}({} {}s): {}{}% | '.format(data[0], data[2], data[4], '+' if data[1] > 0 else '',round(data[1], 2))
         # 移除最后一个 |
         fluctuation_text = fluctuation_text[:-2]
         header_text.set_text(header_text.get_text()[0] + u'\n异动监控: {}'.format(fluctuation_text))
-    
+    # 持仓汇总
+    if len(portfolio.positions) > 0:
+        header_text.set_text(header_text.get_text()[0] + u'\n持仓: 市值 {:,.2f} | 当日盈亏 {:+,.2f}{} | 持仓盈亏 {:+,.2f}{}'.format(
+            portfolio.market_value,
+            portfolio.day_pnl, ' ({:+.2f}%)'.format(portfolio.day_pnl / portfolio.pre_close_value * 100) if portfolio.pre_close_value != 0 else '',
+            portfolio.pnl, ' ({:+.2f}%)'.format(portfolio.pnl / portfolio.cost_value * 100) if portfolio.cost_value != 0 else ''))
+        if portfolio.missing() > 0:
+            header_text.set_text(header_text.get_text()[0] + u' | 没有数据: {}只'.format(portfolio.missing()))
+    # 各阶段的耗时
+    if show_timings:
+        header_text.set_text(header_text.get_text()[0] + u'\n耗时(ms p50/p95/max): {}'.format(stage_timings.format() or '暂无数据'))
+        if hedged_count > 0:
+            header_text.set_text(header_text.get_text()[0] + u' | 对冲请求: {}'.format(hedged_count))
+
+
+# 更新并绘制顶部文本
+def update_header():
+    update_header_text()
     main_loop.draw_screen()
 
 
-# 更新股票监控数据
-def update_monitor_data():
+# 异动监控的滑动时间窗口，使用单调队列维护窗口内的最高价和最低价，每次更新均摊O(1)
+class RollingWindow:
+
+    def __init__(self, seconds, threshold):
+        self.seconds = seconds
+        self.threshold = threshold
+        # (时间戳, 价格)，价格单调递减，队首为窗口内最高价
+        self.max_queue = deque()
+        # (时间戳, 价格)，价格单调递增，队首为窗口内最低价
+        self.min_queue = deque()
+
+    # 加入一条数据并移除超出时间窗口的数据
+    def push(self, timestamp, price):
+        max_queue = self.max_queue
+        min_queue = self.min_queue
+        while max_queue and max_queue[-1][1] <= price:
+            max_queue.pop()
+        max_queue.append((timestamp, price))
+        while min_queue and min_queue[-1][1] >= price:
+            min_queue.pop()
+        min_queue.append((timestamp, price))
+
+        expire = timestamp - self.seconds
+        while max_queue[0][0] < expire:
+            max_queue.popleft()
+        while min_queue[0][0] < expire:
+            min_queue.popleft()
+
+    # 窗口内的涨跌幅(%)及异动完成的时间，最高价晚于最低价为拉升(正)，否则为下跌(负)
+    def fluctuation(self, pre_close):
+        max_time, max_price = self.max_queue[0]
+        min_time, min_price = self.min_queue[0]
+        if max_time > min_time:
+            return (max_price - min_price) / pre_close * 100, max_time
+        return (min_price - max_price) / pre_close * 100, min_time
+
+
+# 更新股票监控数据(只处理本次快照中的股票)
+def update_monitor_data(tickers_data):
     global price_monitor_data
-    global last_price
     global fluctuation_monitor_data
 
-    for ticker, data in last_price.items():
-        if price_monitor_data.get(ticker) is None:
-            price_monitor_data[ticker] = []
-        
-        # price_monitor_data中最后一条数据的时间不能大于等于当前数据的时间
-        if len(price_monitor_data[ticker]) > 0 and price_monitor_data[ticker][-1][31] >= data[31]:
+    if not enable_price_monitor:
+        return
+
+    market_time = 0.0
+    for ticker, data in tickers_data.items():
+        market_time = max(market_time, data.timestamp)
+        # 没有昨收价(停牌、新股上市前)的数据无法计算涨跌幅，也不创建窗口，否则窗口为空时无法比较时间
+        if data.pre_close == 0:
+            continue
+        windows = price_monitor_data.get(ticker)
+        if windows is None:
+            windows = [RollingWindow(seconds, threshold) for seconds, threshold in [monitor_threshold] + extra_monitor_thresholds]
+            price_monitor_data[ticker] = windows
+        # 窗口中最后一条数据的时间不能大于等于当前数据的时间
+        elif windows[0].max_queue and windows[0].max_queue[-1][0] >= data.timestamp:
             continue
-        # 添加新数据
-        price_monitor_data[ticker].append(data)
-        # 价格最大的数据
-        max_price_data = max(price_monitor_data[ticker], key=lambda x: x[3])
-        # 价格最小的数据
-        min_price_data = min(price_monitor_data[ticker], key=lambda x: x[3])
-        fluctuation = 0.0
-        # 判断数据先后，计算涨跌幅，[31]为时间
-        if max_price_data[31] > min_price_data[31]:
-            diff = float(max_price_data[3]) - float(min_price_data[3])
-            fluctuation = diff / float(min_price_data[2]) * 100
-        else:
-            diff = float(min_price_data[3]) - float(max_price_data[3])
-            fluctuation = diff / float(max_price_data[2]) * 100
-        # 如果涨跌幅超过阈值，则触发异动
-        if abs(fluctuation) >= monitor_threshold[1]:
-            fluctuation_monitor_data[ticker] = [max_price_data[0], fluctuation, max_price_data[31]]
-
-        # 清除过期超过阈值时间的数据
-        now = datetime.now()
-        temp_price_monitor_data = price_monitor_data[ticker].copy()
-        for data in temp_price_monitor_data:
-            if (now - datetime.strptime(data[31], '%H:%M:%S')).seconds > monitor_threshold[0]:
-                price_monitor_data[ticker].remove(data)
-        
-    # 清除过期超过3分钟fluctuation_monitor_data数据
-    now = datetime.now()
-    temp_fluctuation_monitor_data = fluctuation_monitor_data.copy()
-    for ticker, data in temp_fluctuation_monitor_data.items():
-        if (now - datetime.strptime(data[2], '%H:%M:%S')).seconds > 3 * 60:
-            fluctuation_monitor_data.pop(ticker)
 
+        triggered = None
+        for window in windows:
+            window.push(data.timestamp, data.price)
+            fluctuation, timestamp = window.fluctuation(data.pre_close)
+            if window is windows[0]:
+                quote_store.fluctuation[quote_store.index[ticker]] = fluctuation
+            # 如果涨跌幅超过阈值，则触发异动(多个窗口同时触发时取幅度最大的)
+            if abs(fluctuation) >= window.threshold and (triggered is None or abs(fluctuation) > abs(triggered[1])):
+                triggered = [data.name, fluctuation, None, timestamp, window.seconds]
+        if triggered is not None:
+            triggered[2] = time.strftime('%H:%M:%S', time.localtime(triggered[3]))
+            # 新的异动(异动完成的时间或窗口发生变化)才发出事件，持续中的异动只更新幅度
+            previous = fluctuation_monitor_data.get(ticker)
+            if previous is None or previous[3] != triggered[3] or previous[4] != triggered[4]:
+                emit_event({
+                    'type': 'anomaly',
+                    'ticker': ticker,
+                    'name': data.name,
+                    'price': data.price,
+                    'fluctuation': round(triggered[1], 3),
+                    'window': triggered[4],
+                    'time': '{} {}'.format(data.date, triggered[2]),
+                })
+            fluctuation_monitor_data[ticker] = triggered
+
+    # 清除超过显示时长的异动数据
+    for ticker in [ticker for ticker, data in fluctuation_monitor_data.items() if market_time - data[3] > fluctuation_display_duration]:
+        fluctuation_monitor_data.pop(ticker)
+    # 最后的数据已经超出时间窗口的股票(停牌、长时间没有成交)窗口内没有数据，涨跌幅归零，快速异动排行只反映当前的时间窗口
+    size = quote_store.size
+    expired = np.flatnonzero((market_time - quote_store.columns['timestamp'][:size] > monitor_threshold[0]) & (quote_store.fluctuation[:size] != 0))
+    quote_store.fluctuation[expired] = 0
+
+
+# 单只股票的自定义监控，价格和涨跌幅监控值分别按从小到大的顺序保存
+# 每次更新时用二分查找找出新旧值之间被跨过的所有监控值，复杂度O(log n)
+class AlertBook:
+
+    def __init__(self):
+        self.prices = []
+        self.percents = []
+
+    def levels(self, kind):
+        return self.prices if kind == 'price' else self.percents
+
+    # 添加监控值(重复的值只保留一个)
+    def add(self, kind, level):
+        levels = self.levels(kind)
+        i = bisect_left(levels, level)
+        if i == len(levels) or levels[i] != level:
+            levels.insert(i, level)
+
+    def clear(self, kind):
+        self.levels(kind).clear()
+
+    def is_empty(self):
+        return len(self.prices) == 0 and len(self.percents) == 0
+
+    # 返回从old变化到new时跨过的监控值，上升时为 old < level <= new，下降时为 new <= level < old
+    @staticmethod
+    def crossed(levels, old, new):
+        if new > old:
+            return levels[bisect_right(levels, old):bisect_right(levels, new)]
+        if new < old:
+            return levels[bisect_left(levels, new):bisect_left(levels, old)]
+        return []
 
 
 # 更新自定义股票监控数据，当价格或涨跌幅跨过(上升和下降都算)设置的值时触发
+# old_data为更新前的数据，new_data为本次快照，只处理价格发生变化的股票
 def update_custom_monitor_data(old_data, new_data):
     global custom_monitor_triggered_data
 
-    for ticker, data in custom_monitor_data.items():
-        # 如果没有监控价格或涨跌幅，则跳过
-        if data[0] is None and data[1] is None:
+    # 遍历较小的一方
+    if len(custom_monitor_data) <= len(new_data):
+        tickers = [ticker for ticker in custom_monitor_data if ticker in new_data]
+    else:
+        tickers = [ticker for ticker in new_data if ticker in custom_monitor_data]
+
+    for ticker in tickers:
+        old = old_data.get(ticker)
+        new = new_data[ticker]
+        # 没有旧数据或价格没有变化，则跳过
+        if old is None or old.price == new.price or new.pre_close == 0:
             continue
-        # 如果没有初始化，则初始化
-        if custom_monitor_triggered_data.get(ticker) is None:
-            custom_monitor_triggered_data[ticker] = []
-        
-        old_price = float(old_data[ticker][3])
-        new_price = float(new_data[ticker][3])
-        old_fluctuation = (float(old_data[ticker][3]) - float(old_data[ticker][2])) / float(old_data[ticker][2]) * 100
-        new_fluctuation = (float(new_data[ticker][3]) - float(new_data[ticker][2])) / float(new_data[ticker][2]) * 100
-        
+        alert_book = custom_monitor_data[ticker]
+        new_fluctuation = (new.price - new.pre_close) / new.pre_close * 100
+
         # 如果价格监控触发
-        if data[0] is not None and (old_price < float(data[0]) <= new_price or old_price > float(data[0]) >= new_price):
-            send_notification('价格监控', f'{new_data[ticker][0]}({ticker}): {round(float(new_data[ticker][3]), 2)}')
+        crossed_prices = AlertBook.crossed(alert_book.prices, old.price, new.price)
+        if len(crossed_prices) > 0:
+            emit_alert('price', ticker, new, new_fluctuation, crossed_prices)
         # 如果涨跌幅监控触发
-        if data[1] is not None and (old_fluctuation < float(data[1]) <= new_fluctuation or old_fluctuation > float(data[1]) >= new_fluctuation):
-            send_notification('涨跌幅监控', f'{new_data[ticker][0]}({ticker}): {round(new_fluctuation, 2)}%')
+        crossed_percents = []
+        if len(alert_book.percents) > 0 and old.pre_close != 0:
+            old_fluctuation = (old.price - old.pre_close) / old.pre_close * 100
+            crossed_percents = AlertBook.crossed(alert_book.percents, old_fluctuation, new_fluctuation)
+            if len(crossed_percents) > 0:
+                emit_alert('percent', ticker, new, new_fluctuation, crossed_percents)
+
+        if len(crossed_prices) > 0 or len(crossed_percents) > 0:
+            custom_monitor_triggered_data[ticker] = [new.name, new.price, new_fluctuation, new.time]
+
+
+# 持仓组合: 每只股票的数量和成本价，以及按股票保存的市值和昨收市值
+# 每次更新只处理快照中(价格发生变化)的持仓股票，合计值减去旧值再加上新值，不重新累加所有持仓
+class Portfolio:
+
+    def __init__(self, positions=None):
+        # 股票代码 -> (数量, 成本价)
+        self.positions = {}
+        # 股票代码 -> (市值, 昨收市值)，还没有数据的持仓不在其中
+        self.values = {}
+        # 有数据的持仓的市值、昨收市值和成本合计
+        self.market_value = 0.0
+        self.pre_close_value = 0.0
+        self.cost_value = 0.0
+        for ticker, (quantity, cost) in (positions or {}).items():
+            self.positions[to_sina_symbol(ticker)] = (float(quantity), float(cost))
+
+    # 写入一次快照(只包含发生变化的股票)
+    def update(self, snapshot):
+        # 遍历较小的一方
+        if len(self.positions) <= len(snapshot):
+            tickers = [ticker for ticker in self.positions if ticker in snapshot]
+        else:
+            tickers = [ticker for ticker in snapshot if ticker in self.positions]
+        for ticker in tickers:
+            quantity, cost = self.positions[ticker]
+            data = snapshot[ticker]
+            # 开盘前或停牌时价格为0，按昨收计算
+            price = data.price if data.price > 0 else data.pre_close
+            value = quantity * price
+            pre_close_value = quantity * data.pre_close
+            old = self.values.get(ticker)
+            if old is None:
+                self.cost_value += quantity * cost
+            else:
+                self.market_value -= old[0]
+                self.pre_close_value -= old[1]
+            self.market_value += value
+            self.pre_close_value += pre_close_value
+            self.values[ticker] = (value, pre_close_value)
+
+    @property
+    def day_pnl(self):
+        return self.market_value - self.pre_close_value
+
+    @property
+    def pnl(self):
+        return self.market_value - self.cost_value
+
+    # 还没有数据的持仓数量
+    def missing(self):
+        return len(self.positions) - len(self.values)
+
+    # 表格中一只股票的持仓列，不持有或没有数据时为空
+    def format_row(self, ticker):
+        values = self.values.get(ticker)
+        if values is None:
+            return ('',) * len(portfolio_columns)
+        quantity, cost = self.positions[ticker]
+        value, pre_close_value = values
+        cost_value = quantity * cost
+        return (
+            '{:g}'.format(quantity), # 持仓
+            '{:,.2f}'.format(value), # 市值
+            '{:+,.2f}'.format(value - pre_close_value), # 当日盈亏
+            '{:+,.2f}'.format(value - cost_value) + (' · {:+.2f}%'.format((value - cost_value) / cost_value * 100) if cost_value != 0 else ''), # 持仓盈亏
+            '{:.2f}%'.format(value / self.market_value * 100) if self.market_value != 0 else '', # 仓位
+        )
+
+
+# 从json文件读取持仓
+def load_positions(path):
+    with open(path, encoding='utf-8') as f:
+        positions = json.load(f)
+    return Portfolio({ticker: (position['quantity'], position.get('cost', 0)) for ticker, position in positions.items()})
+
+
+# 自定义监控触发的事件
+def emit_alert(kind, ticker, data, fluctuation, levels):
+    emit_event({
+        'type': 'alert',
+        'kind': kind,
+        'ticker': ticker,
+        'name': data.name,
+        'price': data.price,
+        'fluctuation': round(fluctuation, 3),
+        'levels': levels,
+        'time': '{} {}'.format(data.date, data.time),
+    })
+
+
+# 将监控事件交给所有的事件接收函数
+def emit_event(event):
+    for listener in event_listeners:
+        listener(event)
+
+
+# 自定义监控触发事件的通知标题和内容
+def format_alert(event):
+    if event['kind'] == 'price':
+        return '价格监控', f'{event["name"]}({event["ticker"]}): {round(event["price"], 2)} 跨过 {format_levels(event["levels"])}'
+    return '涨跌幅监控', f'{event["name"]}({event["ticker"]}): {round(event["fluctuation"], 2)}% 跨过 {format_levels(event["levels"], "%")}'
 
 
 # 发送通知
 def send_notification(title, message):
+    # plyer在第一次发送通知(通知线程)时才导入
+    from plyer import notification
+
     notification.notify(
         title=title,
         message=message,
@@ -635,24 +3038,536 @@ def send_notification(title, message):
         timeout=10
     )
 
+
+# 通知方式: 桌面通知
+class DesktopSink:
+
+    def send(self, title, message, events):
+        send_notification(title, message)
+
+
+# 通知方式: 追加写入日志文件
+class LogSink:
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, title, message, events):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{} {}: {}\n'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), title, message.replace('\n', ' | ')))
+
+
+# 通知方式: 以json格式POST到指定地址(如本地的 benchmarks/webhook_server.py)
+class WebhookSink:
+
+    def __init__(self, url):
+        self.url = url
+        self.session = None
+
+    def send(self, title, message, events):
+        if self.session is None:
+            import requests
+
+            self.session = requests.Session()
+        self.session.post(self.url, json={'title': title, 'message': message, 'events': events}, timeout=5).raise_for_status()
+
+
+# 根据名字创建通知方式
+def make_sink(name):
+    if name == 'desktop':
+        return DesktopSink()
+    if name == 'log':
+        return LogSink(notify_log_file)
+    if name == 'webhook':
+        return WebhookSink(notify_webhook_url)
+    raise ValueError('未知的通知方式: {}'.format(name))
+
+
+# 通知的后台发送队列，刷新流程只负责将事件放入队列，不会等待通知发送完成
+# 1. 同一只股票的同一个监控值在notify_dedup_duration内重复触发时不再通知
+# 2. notify_batch_window内连续触发的监控合并发送，同一只股票的同类监控只保留最新的一条
+# 3. 超出notify_rate_limit的通知暂存，等到可以发送时合并为一条汇总通知
+class NotificationDispatcher:
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.queue = queue.Queue()
+        # (股票代码, 监控类型, 监控值) -> 上一次通知的时间(time.monotonic)
+        self.notified = {}
+        # 最近的通知时间，用于频率限制
+        self.sent_times = deque()
+        # 发送失败的次数和最近一次失败的错误
+        self.failures = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='notification', daemon=True)
+        self.thread.start()
+
+    # 事件接收函数，只处理自定义监控触发的事件
+    def submit(self, event):
+        if event['type'] == 'alert':
+            self.queue.put(event)
+
+    # 停止发送线程，暂存的通知会在退出前发送
+    def close(self, timeout=None):
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def run(self):
+        # (股票代码, 监控类型) -> 等待发送的事件
+        pending = {}
+        closed = False
+        while not closed:
+            try:
+                event = self.queue.get(timeout=self.wait_time() if len(pending) > 0 else None)
+            except queue.Empty:
+                event = None
+            else:
+                closed = event is None
+            if event is not None:
+                self.merge(pending, event)
+                # 收集一小段时间内连续触发的事件
+                deadline = time.monotonic() + notify_batch_window
+                while not closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        event = self.queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if event is None:
+                        closed = True
+                    else:
+                        self.merge(pending, event)
+            if len(pending) > 0 and (closed or self.wait_time() == 0):
+                self.deliver(list(pending.values()))
+                pending.clear()
+
+    # 去掉近期已经通知过的监控值，将事件合并到同一只股票同类监控的待发送事件中
+    def merge(self, pending, event):
+        now = time.monotonic()
+        levels = []
+        for level in event['levels']:
+            key = (event['ticker'], event['kind'], level)
+            last = self.notified.get(key)
+            if last is None or now - last >= notify_dedup_duration:
+                self.notified[key] = now
+                levels.append(level)
+        if len(levels) == 0:
+            return
+        key = (event['ticker'], event['kind'])
+        previous = pending.get(key)
+        if previous is not None:
+            levels = sorted(set(previous['levels']) | set(levels))
+        pending[key] = dict(event, levels=levels)
+
+    # 距离下一次可以发送通知的时间(s)
+    def wait_time(self):
+        period, limit = notify_rate_limit
+        now = time.monotonic()
+        while self.sent_times and now - self.sent_times[0] >= period:
+            self.sent_times.popleft()
+        if len(self.sent_times) < limit:
+            return 0
+        return self.sent_times[0] + period - now
+
+    # 发送通知，多条事件合并为一条汇总通知
+    def deliver(self, events):
+        if len(events) == 1:
+            title, message = format_alert(events[0])
+        else:
+            title = '监控提醒({}条)'.format(len(events))
+            message = '\n'.join(format_alert(event)[1] for event in events)
+        self.sent_times.append(time.monotonic())
+        for sink in self.sinks:
+            try:
+                sink.send(title, message, events)
+            except Exception as e:
+                # 一种通知方式失败不影响其他方式
+                self.error = e
+                self.failures += 1
+
+# 解析命令行参数
+def parse_args():
+    parser = argparse.ArgumentParser(description='在终端实时显示股票信息')
+    parser.add_argument('--quote-url', metavar='URL', default=quote_url, help='行情接口地址')
+    parser.add_argument('--record', metavar='FILE', default=record_file, help='将每次获取的数据追加记录到文件')
+    parser.add_argument('--replay', metavar='FILE', default=replay_file, help='回放记录文件中的数据(不请求网络)')
+    parser.add_argument('--speed', type=float, default=replay_speed, help='回放速度倍数，0为不等待')
+    parser.add_argument('--ignore-trading-hours', action='store_true', help='不按照交易时间暂停自动刷新(如连接本地模拟接口时)')
+    parser.add_argument('--tickers', metavar='FILE', help='从文件读取股票代码(以空白或逗号分隔，#开头的行为注释)')
+    parser.add_argument('--watchlist', metavar='FILE', default=watchlist_file, help='从json文件读取自选股分组 {组名: [股票代码, ...]}，文件修改后自动重新加载')
+    parser.add_argument('--visible-only', action='store_true', help='只按刷新间隔获取当前显示的分组，其他分组每hidden_group_refresh_duration秒获取一次')
+    parser.add_argument('--scan', action='store_true', help='全市场扫描: 获取scanner_universe中的全部股票，按涨幅排行显示(未指定--tickers和--watchlist时)')
+    parser.add_argument('--alerts', metavar='FILE', help='从json文件读取自定义监控 {股票代码: {"price": [...], "percent": [...]}}')
+    parser.add_argument('--daemon', action='store_true', help='无界面模式: 只获取数据和监控，将事件以json行输出')
+    parser.add_argument('--output', metavar='FILE', help='无界面模式的输出文件(追加写入)，默认为标准输出')
+    parser.add_argument('--no-snapshots', action='store_true', help='无界面模式下只输出监控事件，不输出数据快照')
+    parser.add_argument('--bars', action='store_true', help='无界面模式下输出完成的K线(周期见bar_timeframes)')
+    parser.add_argument('--positions', metavar='FILE', default=positions_file, help='从json文件读取持仓 {股票代码: {"quantity": 数量, "cost": 成本价}}，显示市值和盈亏')
+    parser.add_argument('--checkpoint', metavar='FILE', default=checkpoint_file, help='定期保存状态(最后的数据、异动监控、自定义监控)到文件，重新启动时恢复')
+    parser.add_argument('--hub', metavar='SOCKET', default=hub_socket, help='从共享行情的hub订阅数据(不直接请求接口)')
+    parser.add_argument('--serve-hub', metavar='SOCKET', help='作为共享行情的hub运行: 合并所有终端订阅的股票统一请求接口，通过Unix socket推送')
+    parser.add_argument('--shards', type=int, default=shard_count, metavar='N', help='使用N个进程分别获取和解析一部分股票，数据通过共享内存传递(股票很多时使用)')
+    parser.add_argument('--timings', metavar='FILE', help='退出时将各阶段耗时的统计(p50/p95/max)写入json文件')
+    parser.add_argument('--profile', metavar='FILE', help='使用cProfile统计主线程的耗时，退出时写入文件(可用pstats或snakeviz查看)')
+    parser.add_argument('--notify', metavar='SINKS', help='自定义监控的通知方式，逗号分隔: desktop,log,webhook (无界面模式默认不通知)')
+    parser.add_argument('--notify-log', metavar='FILE', default=notify_log_file, help='通知日志文件')
+    parser.add_argument('--notify-webhook', metavar='URL', default=notify_webhook_url, help='通知的webhook地址')
+    return parser.parse_args()
+
+
+# 从文件读取股票代码
+def load_tickers(path):
+    result = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0]
+            result += [ticker for ticker in re.split(r'[\s,，]+', line) if ticker != '']
+    return result
+
+
+# 全市场扫描的股票代码
+def scanner_tickers():
+    return ['{}{:06d}'.format(market, code) for market, start, end in scanner_universe for code in range(start, end)]
+
+
+# 从json文件读取自定义监控
+def load_alerts(path):
+    with open(path, encoding='utf-8') as f:
+        alerts = json.load(f)
+    for ticker, levels in alerts.items():
+        # 文件中的代码可以不带市场前缀，与自选股一样规范化
+        ticker = to_sina_symbol(ticker)
+        alert_book = custom_monitor_data.setdefault(ticker, AlertBook())
+        for kind in ['price', 'percent']:
+            for level in levels.get(kind, []):
+                alert_book.add(kind, float(level))
+        if alert_book.is_empty():
+            custom_monitor_data.pop(ticker)
+
+
+# 启动通知队列
+def start_notifications(sinks):
+    global notification_dispatcher
+
+    if len(sinks) == 0:
+        return
+    notification_dispatcher = NotificationDispatcher([make_sink(name) for name in sinks])
+    event_listeners.append(notification_dispatcher.submit)
+
+
+# 停止通知队列，最多等待timeout秒发送暂存的通知
+def stop_notifications(timeout=3):
+    global notification_dispatcher
+
+    if notification_dispatcher is None:
+        return
+    event_listeners.remove(notification_dispatcher.submit)
+    notification_dispatcher.close(timeout)
+    notification_dispatcher = None
+
+
+# 打开数据源: 回放模式读取记录文件，指定了hub时连接hub，指定了分片数时启动分片进程，否则请求接口，除回放外都按需创建记录文件
+def open_data_source():
+    global tick_recorder
+    global replay_source
+    global hub_source
+    global shard_source
+
+    if replay_file is not None:
+        replay_source = ReplaySource(replay_file, replay_speed)
+        return
+    if hub_socket is not None:
+        hub_source = HubClient(hub_socket, watchlist.all.symbols)
+    elif shard_count > 0:
+        # 去掉重复的股票，每只股票在数据表中只有一行
+        shard_source = ShardedSource(watchlist.all.symbols, shard_count)
+    if record_file is not None:
+        tick_recorder = TickRecorder(record_file)
+
+
+# 从检查点恢复状态并开始定期保存检查点(回放时不使用检查点)
+def open_checkpoint():
+    global checkpointer
+
+    if checkpoint_file is None or replay_file is not None:
+        return
+    if os.path.exists(checkpoint_file):
+        try:
+            restore_checkpoint(checkpoint_file)
+        except (OSError, ValueError, KeyError) as e:
+            print('检查点恢复失败: {}'.format(e), file=sys.stderr)
+    checkpointer = Checkpointer(checkpoint_file, checkpoint_interval)
+
+
+# 退出时保存最后一次检查点
+def close_checkpoint():
+    global checkpointer
+
+    if checkpointer is not None:
+        checkpointer.close()
+        if checkpointer.error is not None:
+            print('检查点保存失败: {}'.format(checkpointer.error), file=sys.stderr)
+        checkpointer = None
+
+
+# 关闭数据源: 结束分片进程并删除共享内存，关闭记录文件
+def close_data_source():
+    global shard_source
+
+    if shard_source is not None:
+        shard_source.close()
+        shard_source = None
+    if tick_recorder is not None:
+        tick_recorder.close()
+
+
+# 数据快照中一只股票输出的字段
+def quote_to_dict(data):
+    return {
+        'name': data.name,
+        'price': data.price,
+        'pre_close': data.pre_close,
+        'open': data.open,
+        'high': data.high,
+        'low': data.low,
+        'volume': data.volume,
+        'amount': data.amount,
+        'fluctuation': round((data.price - data.pre_close) / data.pre_close * 100, 3) if data.pre_close != 0 else 0,
+        'time': '{} {}'.format(data.date, data.time),
+    }
+
+
+# 无界面模式: 循环获取数据并更新监控，将监控事件和数据快照以json行输出(不创建界面，不渲染表格)
+# 快照中只包含价格或数据时间发生变化的股票，K线只输出本次刷新中完成的K线
+def run_daemon(output_file=None, write_snapshots=True, write_bars=False):
+    output = sys.stdout if output_file is None else open(output_file, 'a', encoding='utf-8')
+
+    def write_event(event):
+        output.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    # 后台线程(检查点、通知)新的失败在主循环中输出为error事件
+    reported_failures = {'checkpoint': 0, 'notification': 0}
+
+    def write_failures():
+        for source, worker in [('checkpoint', checkpointer), ('notification', notification_dispatcher)]:
+            if worker is None or worker.failures <= reported_failures[source]:
+                continue
+            reported_failures[source] = worker.failures
+            error = worker.error
+            if error is not None:
+                write_event({'type': 'error', 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'source': source, 'error': type(error).__name__, 'message': str(error)})
+
+    event_listeners.append(write_event)
+    start_notifications(notify_sinks)
+    open_data_source()
+    open_checkpoint()
+    # 收到SIGTERM时正常退出，关闭记录文件和输出文件
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+    try:
+        while True:
+            start = time.monotonic()
+            reload_watchlist()
+            batch = scheduler.next_batch() if polls_upstream() else None
+            try:
+                # 休市中或者没有需要获取的重点股票时不请求
+                snapshot = get_snapshot(batch) if batch is None or len(batch) > 0 else {}
+            except EOFError:
+                break
+            except Exception as e:
+                write_event({'type': 'error', 'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'error': type(e).__name__, 'message': str(e)})
+            else:
+                changed = {}
+                for ticker, data in snapshot.items():
+                    old = last_price.get(ticker)
+                    if old is None or old.price != data.price or old.timestamp != data.timestamp:
+                        changed[ticker] = quote_to_dict(data)
+                update_quotes(snapshot)
+                if checkpointer is not None:
+                    checkpointer.maybe_save()
+                if write_snapshots and len(changed) > 0:
+                    write_event({'type': 'snapshot', 'time': last_request_time, 'quotes': changed})
+                if write_bars:
+                    for timeframe in bar_aggregator.completed:
+                        write_event({'type': 'bars', 'timeframe': timeframe, 'bars': bar_aggregator.completed_bars(quote_store, timeframe)})
+            write_failures()
+            output.flush()
+
+            if polls_upstream():
+                delay = scheduler.next_delay() - (time.monotonic() - start)
+            else:
+                delay = get_next_delay()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        event_listeners.remove(write_event)
+        stop_notifications()
+        close_checkpoint()
+        close_data_source()
+        if output is not sys.stdout:
+            output.close()
+
+
+# hub模式: 合并所有终端订阅的股票，按照刷新调度统一请求接口，通过Unix socket推送给各终端
+# 新订阅的股票立即获取一次(休市时也会获取，用于显示收盘数据)
+def run_hub(path):
+    hub = QuoteHub(path)
+    hub.start()
+    open_data_source()
+    signal.signal(signal.SIGTERM, lambda _signum, _frame: sys.exit(0))
+    next_poll = 0
+    try:
+        while True:
+            hub.wakeup.wait(max(next_poll - time.monotonic(), 0))
+            hub.wakeup.clear()
+            symbols = hub.symbols()
+            now = time.monotonic()
+            if now >= next_poll:
+                next_poll = now + scheduler.next_delay()
+                if scheduler.market_wait == 0:
+                    batch = symbols
+                else:
+                    batch = [symbol for symbol in symbols if symbol not in hub.quotes]
+            else:
+                batch = [symbol for symbol in symbols if symbol not in hub.quotes]
+            if len(batch) == 0:
+                continue
+            try:
+                snapshot = get_snapshot(batch)
+            except Exception as e:
+                hub.publish_error(e)
+            else:
+                hub.publish(snapshot)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hub.close()
+        close_data_source()
+
+
+# 创建界面容器、数据表格和主循环
+def build_ui():
+    global header_text
+    global quote_text
+    global quote_filler
+    global quote_table
+    global quote_box
+    global menu
+    global footer_input
+    global layout
+    global main_loop
+
+    header_text = urwid.Text(u'实时数据')
+    header = urwid.AttrMap(header_text, 'titlebar')
+    quote_text = urwid.Text(u'按下 (R/r) 以获取数据...')
+    quote_filler = urwid.Filler(quote_text, valign='top', top=1, bottom=1)
+    quote_table = QuoteTable(table_columns + (portfolio_columns if len(portfolio.positions) > 0 else []), get_table_row)
+    quote_box = urwid.WidgetPlaceholder(quote_filler)
+    menu = urwid.Text(default_menu)
+    footer_input = urwid.Edit(u'')
+    layout = urwid.Frame(header=header, body=quote_box, footer=menu)
+    main_loop = urwid.MainLoop(layout, palette=palette if use_palette else [], unhandled_input=handle_input)
+
+
 def run():
     global urwid_alarm
     global auto_refresh
-
-    # 当前是否为交易时间
-    # 交易时间为非节假日的周一至周五 9:30-11:30  13:00-15:00
-    now = datetime.now()
-    time_str = now.strftime('%H:%M')
-    if not ((calendar.is_workday(now) and 1 <= now.isoweekday() <= 5) and ('09:15' <= time_str <= '11:30' or '13:00' <= time_str <= '15:05')):
-        auto_refresh = False
+    global fetch_pipe
+
+    build_ui()
+    start_notifications(notify_sinks)
+    open_data_source()
+    open_checkpoint()
+    if replay_source is not None:
+        # 回放模式始终自动刷新
+        auto_refresh = True
+    # 第一帧直接显示从检查点恢复的数据
+    if len(last_price) > 0:
+        render_table(get_update_table())
+        update_header_text()
+
+    # 后台线程通过管道唤醒主循环
+    fetch_pipe = main_loop.watch_pipe(on_snapshot_ready)
 
     urwid_alarm = main_loop.set_alarm_in(0, refresh)
-    main_loop.run()
-
-
-# 构建ansi调色板
-palette = palette + build_ansi_palette()
-# 创建主循环
-main_loop = urwid.MainLoop(layout, palette=palette if use_palette else [], unhandled_input=handle_input)
-# 开始运行
-run()
+    try:
+        main_loop.run()
+    finally:
+        stop_notifications()
+        close_checkpoint()
+        close_data_source()
+
+
+# 创建列式数据存储
+quote_store = QuoteStore()
+# 创建分时数据存储
+intraday_history = IntradayHistory()
+# 创建K线生成器
+bar_aggregator = BarAggregator()
+# 创建耗时统计
+stage_timings = StageTimings(timing_samples)
+# 创建刷新调度
+scheduler = RefreshScheduler()
+# 创建自选股分组
+watchlist = Watchlist({'自选': tickers})
+# 创建持仓组合
+portfolio = Portfolio()
+# 创建排行榜
+leaderboards = {name: Leaderboard(scanner_top_n, key) for name, key in sort_modes if key is not None}
+# 创建熔断器
+fetch_breaker = CircuitBreaker(breaker_failure_threshold, breaker_reset_duration)
+
+if __name__ == '__main__':
+    args = parse_args()
+    quote_url = args.quote_url
+    record_file = args.record
+    replay_file = args.replay
+    replay_speed = args.speed
+    checkpoint_file = args.checkpoint
+    hub_socket = args.hub
+    shard_count = args.shards
+    follow_trading_hours = follow_trading_hours and not args.ignore_trading_hours
+    watch_visible_group_only = watch_visible_group_only or args.visible_only
+    if args.watchlist is not None:
+        watchlist = Watchlist.load(args.watchlist)
+    elif args.tickers is not None:
+        watchlist = Watchlist({'自选': load_tickers(args.tickers)})
+    elif args.scan:
+        watchlist = Watchlist({'全市场': scanner_tickers()})
+    if args.scan:
+        sort_mode = [name for name, key in sort_modes].index('涨幅')
+    if args.alerts is not None:
+        load_alerts(args.alerts)
+    if args.positions is not None:
+        portfolio = load_positions(args.positions)
+    notify_log_file = args.notify_log
+    notify_webhook_url = args.notify_webhook
+    if args.notify is not None:
+        notify_sinks = [name for name in args.notify.split(',') if name != '']
+    elif args.daemon:
+        # 无界面模式的监控事件已经输出为json行，默认不再通知
+        notify_sinks = []
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    # 开始运行
+    try:
+        if args.serve_hub is not None:
+            run_hub(args.serve_hub)
+        elif args.daemon:
+            run_daemon(args.output, not args.no_snapshots, args.bars)
+        else:
+            run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.timings is not None:
+            with open(args.timings, 'w', encoding='utf-8') as f:
+                json.dump(stage_timings.summary(), f, ensure_ascii=False, indent=2)